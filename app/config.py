@@ -45,6 +45,101 @@ class Config:
         "port": "5432"
     }
 
+    # RAG 索引設定
+    # 背景監看 error_docs/ 的輪詢間隔 (秒)，<= 0 代表不啟動監看 (卡片異動要重啟或手動重建索引才會生效)
+    ERROR_DOCS_WATCH_INTERVAL = float(os.getenv("ERROR_DOCS_WATCH_INTERVAL", "10"))
+    # embedding 本機快取 (SQLite)，設為空字串可停用
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./data/embedding_cache.sqlite3")
+    # 快取沒命中的文字，每批最多送幾筆給 embedding provider
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+    # retrieve_cards 的查詢快取 (以遮蔽時間戳 / UUID / IP 後的 query 當 key)
+    QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+    QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))
+    # BM25 最高分卡片涵蓋 query 詞的比例 (idf 加權) 達到這個值，就不再跑向量檢索
+    LEXICAL_STRONG_COVERAGE = float(os.getenv("LEXICAL_STRONG_COVERAGE", "0.6"))
+    # 一次檢索最多回給 LLM 多少字的卡片段落 (所有卡片加總)，0 代表不裁切、回傳完整卡片
+    RAG_CONTEXT_CHAR_BUDGET = int(os.getenv("RAG_CONTEXT_CHAR_BUDGET", "2400"))
+    # 向量檢索後端："chroma" (預設) 或 "numpy" (記憶體內精確 cosine 搜尋，向量從 Chroma 匯出)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+    NUMPY_INDEX_DIR = os.getenv("NUMPY_INDEX_DIR", "./vector_index")
+    # 保留幾個索引版本 (含目前版本)，舊版本可瞬間 rollback
+    INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "2"))
+    # 預建的可攜式索引檔 (scripts/export_index.py 產生)；存在時啟動直接載入，不呼叫 embedding provider
+    INDEX_ARTIFACT_PATH = os.getenv("INDEX_ARTIFACT_PATH", "")
+
+    # 對話串流：token 合併成畫面更新的間隔 (秒)，0 代表每個 token 都更新
+    STREAM_FRAME_INTERVAL = float(os.getenv("STREAM_FRAME_INTERVAL", "0.05"))
+
+    # 對話並發控制：全域 / 每位使用者同時處理幾個請求，超過的排隊
+    CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "16"))
+    CHAT_MAX_CONCURRENCY_PER_USER = int(os.getenv("CHAT_MAX_CONCURRENCY_PER_USER", "2"))
+    # 最多幾個請求排隊；排隊超過 CHAT_QUEUE_TIMEOUT 秒就請使用者稍後再試
+    CHAT_MAX_WAITING = int(os.getenv("CHAT_MAX_WAITING", "64"))
+    CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "120"))
+    # 同步工具 (DB / SMTP / Jira / GitHub) 在 async 路徑上使用的 thread pool 大小
+    TOOL_THREAD_WORKERS = int(os.getenv("TOOL_THREAD_WORKERS", "32"))
+
+    # 快速路徑：patterns 明確命中單一張卡片時不跑完整的 Agent 迴圈
+    # "llm" = 一次精簡的 LLM 呼叫改寫卡片，"template" = 不呼叫 LLM 直接回傳卡片，"off" = 停用
+    FAST_PATH_MODE = os.getenv("FAST_PATH_MODE", "llm").lower()
+    # 命中的文字至少要這麼長才算「明確」
+    FAST_PATH_MIN_MATCH_CHARS = int(os.getenv("FAST_PATH_MIN_MATCH_CHARS", "8"))
+    # 輸入超過這個長度 (例如貼了整份 log) 就交給完整 Agent
+    FAST_PATH_MAX_INPUT_CHARS = int(os.getenv("FAST_PATH_MAX_INPUT_CHARS", "4000"))
+
+    # 預先檢索：第一次 LLM 呼叫的同時先用使用者輸入跑 retrieve_cards
+    PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+    # search_error_cards 的查詢詞有多少比例出現在使用者輸入裡，才沿用預先檢索的結果
+    PREFETCH_MIN_OVERLAP = float(os.getenv("PREFETCH_MIN_OVERLAP", "0.8"))
+
+    # 唯讀工具的結果快取 (相同參數在 TTL 秒內直接回傳上次結果；0 代表該工具不快取)
+    TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "true").lower() == "true"
+    TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "256"))
+    TOOL_CACHE_TTL_GUARDRAILS = float(os.getenv("TOOL_CACHE_TTL_GUARDRAILS", "600"))
+    TOOL_CACHE_TTL_MODEL_EOL = float(os.getenv("TOOL_CACHE_TTL_MODEL_EOL", str(6 * 60 * 60)))
+    TOOL_CACHE_TTL_WEB_SEARCH = float(os.getenv("TOOL_CACHE_TTL_WEB_SEARCH", "1800"))
+    # 只套用在指定了已結束的 start_time / end_time 的 log 查詢
+    TOOL_CACHE_TTL_LOG_SEARCH = float(os.getenv("TOOL_CACHE_TTL_LOG_SEARCH", "600"))
+
+    # 對話歷史壓縮：最近幾輪原封不動保留，更早的換成摘要；整體以估算的 token 數控制 (0 代表不壓縮)
+    HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+    HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+
+    # 伺服器端的對話狀態 (每個 session 記住已轉換的歷史，每輪只處理新增的訊息)
+    SESSION_MAX_IN_MEMORY = int(os.getenv("SESSION_MAX_IN_MEMORY", "500"))
+    # 所有 session 在記憶體中的估算總大小上限 (bytes，含轉好的 base64 圖片)；0 代表不限制
+    SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+    # 超過這麼久 (秒) 沒有新訊息的 session 直接清掉
+    SESSION_TTL = float(os.getenv("SESSION_TTL", str(6 * 60 * 60)))
+    # 有設定時，記憶體放不下的 session 寫進這個 SQLite 檔 (例如 data/sessions.db)；空字串代表直接丟掉
+    SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "")
+
+    # 圖片：長邊縮到 IMAGE_MAX_SIDE、重新壓縮 (webp / jpeg / png) 後快取 base64
+    IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1568"))
+    IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp").lower()
+    IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    # 歷史紀錄裡的圖片只保留最近幾輪，更早的只留檔名
+    IMAGE_HISTORY_MAX_TURNS = int(os.getenv("IMAGE_HISTORY_MAX_TURNS", "2"))
+
+    # 上傳檔案處理
+    # .log / .txt 超過這個大小 (bytes) 就改用串流彙整 (樣板計數)，不再整份塞進 prompt
+    LOG_TRIAGE_MIN_BYTES = int(os.getenv("LOG_TRIAGE_MIN_BYTES", "16384"))
+    # 彙整後交給 agent 的錯誤樣板數量
+    LOG_TRIAGE_TOP_N = int(os.getenv("LOG_TRIAGE_TOP_N", "20"))
+    # 記憶體中最多保留幾種樣板 (超過會丟掉低頻樣板)
+    LOG_TRIAGE_MAX_TEMPLATES = int(os.getenv("LOG_TRIAGE_MAX_TEMPLATES", "5000"))
+    LOG_TRIAGE_CHUNK_BYTES = int(os.getenv("LOG_TRIAGE_CHUNK_BYTES", str(1024 * 1024)))
+    # 彙整後用 retrieve_cards_batch 一次查出主要錯誤樣板對應的卡片
+    LOG_TRIAGE_CARD_LOOKUP = os.getenv("LOG_TRIAGE_CARD_LOOKUP", "true").lower() == "true"
+    # PDF / DOCX 在獨立的 process pool 裡逐頁解析；超過頁數 / 字數 / 秒數就只保留已讀到的部分
+    DOC_EXTRACT_WORKERS = int(os.getenv("DOC_EXTRACT_WORKERS", "2"))
+    DOC_EXTRACT_TIMEOUT = float(os.getenv("DOC_EXTRACT_TIMEOUT", "30"))
+    DOC_MAX_PAGES = int(os.getenv("DOC_MAX_PAGES", "200"))
+    DOC_MAX_CHARS = int(os.getenv("DOC_MAX_CHARS", "60000"))
+    # 解析結果以檔案內容 hash 快取，總字數上限
+    DOC_CACHE_MAX_CHARS = int(os.getenv("DOC_CACHE_MAX_CHARS", str(5_000_000)))
+
     # Guardrails API
     GUARDRAILS_API_URL = "http://127.0.0.1:7860/"
 
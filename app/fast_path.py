@@ -0,0 +1,73 @@
+# app/fast_path.py
+import re
+from typing import AsyncIterator, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app.config import settings
+from app.llm_factory import get_llm
+from app.prompts import FAST_PATH_PROMPT
+from app.rag.models import ErrorCard
+from app.rag.retriever import match_patterns
+from app.utils.streaming import content_to_text
+
+# 使用者想做「動作」(查 Log / 寄信 / 開單 ...) 的訊息一律交給完整的 Agent
+_TOOL_INTENT_RE = re.compile(
+    r"寄信|email|mail|工程師|jira|開單|週報|查\s*log|log\s*查|剛剛|幾點|護欄檢查|檢查.*prompt|照片|eol|下架|key\s*name",
+    re.IGNORECASE,
+)
+
+MODE_OFF = "off"
+MODE_LLM = "llm"
+MODE_TEMPLATE = "template"
+
+
+def find_fast_path_card(text: str, has_images: bool = False, has_history: bool = False) -> Optional[ErrorCard]:
+    """
+    判斷這一輪能不能走快速路徑：patterns 明確命中「單一張」卡片才回傳該卡片。
+
+    - 只有一張卡命中，或第一名的命中長度至少是第二名的兩倍
+    - 命中的文字夠長 (FAST_PATH_MIN_MATCH_CHARS)，避免短關鍵字誤判
+    - 有圖片、輸入太長、或看起來需要呼叫工具 (查 Log / 寄信 / 開單 ...) 時不走
+    - 只用在對話的第一輪：快速路徑的 prompt 不帶對話紀錄，追問 (「那第二步呢？」) 要交給 Agent
+    """
+    if settings.FAST_PATH_MODE == MODE_OFF or has_images or has_history:
+        return None
+    text = (text or "").strip()
+    if not text or len(text) > settings.FAST_PATH_MAX_INPUT_CHARS or _TOOL_INTENT_RE.search(text):
+        return None
+
+    matches = match_patterns(text)
+    if not matches:
+        return None
+
+    top = matches[0]
+    if top.longest < settings.FAST_PATH_MIN_MATCH_CHARS:
+        return None
+    if len(matches) > 1 and top.longest < 2 * matches[1].longest:
+        return None
+    return top.card
+
+
+def render_card_answer(card: ErrorCard) -> str:
+    """不呼叫 LLM，直接把卡片內容排版成回答。"""
+    return f"🐾 Wuli 在維運手冊找到了對應的說明 ({card.id})：\n\n{card.content}"
+
+
+async def stream_card_answer(card: ErrorCard, user_text: str) -> AsyncIterator[str]:
+    """
+    一次精簡的 LLM 呼叫 (卡片內容 + 使用者訊息)，逐段回傳文字 delta；
+    FAST_PATH_MODE=template 時不呼叫 LLM，直接回傳卡片排版。
+    """
+    if settings.FAST_PATH_MODE == MODE_TEMPLATE:
+        yield render_card_answer(card)
+        return
+
+    messages = [
+        SystemMessage(content=FAST_PATH_PROMPT),
+        HumanMessage(content=f"【維運手冊卡片 {card.id}】\n{card.content}\n\n【使用者訊息】\n{user_text}"),
+    ]
+    async for chunk in get_llm().astream(messages):
+        delta = content_to_text(chunk.content)
+        if delta:
+            yield delta
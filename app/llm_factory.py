@@ -1,4 +1,5 @@
 # app/llm_factory.py
+import threading
 
 from langchain_openai import ChatOpenAI, AzureChatOpenAI
 from langchain_aws import ChatBedrock
@@ -10,9 +11,6 @@ from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from app.config import settings
 from app.prompts import SYSTEM_PROMPT
 
-# 引入 RAG 初始化函式
-from app.rag.retriever import init_rag
-
 # 引入拆分後的工具 (請確保這些檔案已建立)
 from app.tools.ops import search_error_cards, search_litellm_logs_admin, search_litellm_logs_user
 from app.tools.communication import send_email_to_engineer
@@ -23,6 +21,8 @@ from app.tools.incident import log_incident_for_weekly_report
 from app.tools.selfie import send_wuli_photo
 from app.tools.jira_ops import report_issue_to_jira
 from app.tools.lifecycle import check_model_eol
+from app.tools.cache import cached_tool, has_absolute_window, has_search_results, is_ok_text
+from app.tools.executor import offload_tool
 
 def build_llm():
     """
@@ -51,7 +51,8 @@ def build_llm():
         region_name=settings.AWS_REGION,  # 或是你模型開通的區域，如 us-west-2
         model_kwargs={
             "temperature": 0.2,
-        }
+        },
+        streaming=True
     )
 
     else: # 預設為 OpenAI
@@ -66,6 +67,22 @@ def build_llm():
             streaming=True
         )
 
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """
+    共用的 LLM 實體 (給不需要 Agent 的單次呼叫用，例如 app/fast_path.py)。
+    """
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = build_llm()
+    return _llm
+
+
 def build_agent_executor(is_admin: bool = False):
     """
     組裝 LLM、Tools 與 Prompt，建立 Agent 執行器。
@@ -75,22 +92,33 @@ def build_agent_executor(is_admin: bool = False):
     根據是否為管理員，回傳不同權限的 Agent
     """
     
+    # 🔥 兩個版本的工具對 LLM 都叫 search_litellm_logs (見 app/tools/ops.py)，
+    # 這裡只挑選，不再去改共用工具物件的 name (admin / user 同時建立時會互相覆蓋)
     if is_admin:
         log_tool = search_litellm_logs_admin
     else:
         log_tool = search_litellm_logs_user
-    
-    # 🔥 強制將工具名稱統一，這樣 System Prompt 不需要為了不同人寫兩套
-    log_tool.name = "search_litellm_logs"
 
     # 2. 定義基礎工具
+    # 唯讀的查詢工具包上結果快取 (見 app/tools/cache.py)；寄信 / 自拍這類有副作用或要隨機的不包。
+    # search_error_cards 不包：retrieve_cards 本身有跟著索引版本失效的查詢快取
     base_tools = [
         search_error_cards,            
-        log_tool,                      # <--- 這裡放動態決定的工具
-        get_search_tool,               
-        verify_prompt_with_guardrails, 
+        cached_tool(                   # <--- 這裡放動態決定的工具
+            log_tool, settings.TOOL_CACHE_TTL_LOG_SEARCH,
+            cacheable_args=has_absolute_window, cacheable_result=is_ok_text,
+        ),
+        cached_tool(
+            get_search_tool, settings.TOOL_CACHE_TTL_WEB_SEARCH,
+            casefold_args=("query",), cacheable_result=has_search_results,
+        ),
+        cached_tool(verify_prompt_with_guardrails, settings.TOOL_CACHE_TTL_GUARDRAILS, cacheable_result=is_ok_text),
         send_wuli_photo,               
-        check_model_eol,              
+        # model_name 會原樣出現在回傳的提示裡 (要求「完全符合」)，不做大小寫正規化
+        cached_tool(
+            check_model_eol, settings.TOOL_CACHE_TTL_MODEL_EOL,
+            casefold_args=("provider",), cacheable_result=is_ok_text,
+        ),
         send_email_to_engineer,        
     ]
 
@@ -108,9 +136,11 @@ def build_agent_executor(is_admin: bool = False):
     else:
         print("👤 啟用 User 模式：僅授權唯讀/查詢工具")
         tools = base_tools
-    # 1. 初始化 RAG (載入 ChromaDB)
-    # 放在這裡的好處是：只有在 Agent 真正要被建立時，才會去讀取 Vector DB，加快 import 速度
-    init_rag() 
+    # 同步工具在 astream_events 底下改跑在專用的 tool thread pool (TOOL_THREAD_WORKERS)
+    tools = [offload_tool(t) for t in tools]
+    # 1. RAG 索引不在這裡建立：
+    # 服務啟動時由 app.rag.retriever.ensure_rag_index() 建好 (或載入既有的)，
+    # 之後由 app.rag.watcher 監看 error_docs/ 變動才重建，請求路徑上不再有 embedding 成本。
 
     # 2. 建立 LLM
     llm = build_llm()
@@ -133,18 +163,51 @@ def build_agent_executor(is_admin: bool = False):
     return AgentExecutor(agent=agent, tools=tools, verbose=True)
 
 
-class AgentSingleton:
+class AgentRegistry:
     """
-    單例模式管理器 (Singleton Pattern)
-    確保整個應用程式生命週期中，AgentExecutor 只會被初始化一次。
-    避免重複連線資料庫或重複載入 RAG 模型。
+    依角色 (admin / user) 快取 AgentExecutor 的註冊表。
+    每個角色在整個應用程式生命週期中只會建立一次，所有請求共用同一個執行器。
+
+    AgentExecutor 本身不保存對話狀態 (歷史紀錄都由呼叫端傳入)，
+    因此可以安全地被多個同時進行的請求共用；這裡的 lock 只負責避免同一角色被重複建立。
     """
-    _instance = None
-    
+    _executors = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def role_of(is_admin: bool) -> str:
+        return "admin" if is_admin else "user"
+
+    @classmethod
+    def get_executor(cls, is_admin: bool = False):
+        role = cls.role_of(is_admin)
+        executor = cls._executors.get(role)
+        if executor is not None:
+            return executor
+
+        with cls._lock:
+            # double-checked：拿到鎖之後再確認一次，避免兩個請求同時建立
+            executor = cls._executors.get(role)
+            if executor is None:
+                print(f"🤖 初始化 Wuli Agent ({role}) ...")
+                executor = build_agent_executor(is_admin=is_admin)
+                cls._executors[role] = executor
+                print(f"✅ Wuli Agent ({role}) 就緒！")
+        return executor
+
     @classmethod
-    def get_executor(cls):
-        if cls._instance is None:
-            print("🤖 初始化 Wuli Agent ...")
-            cls._instance = build_agent_executor()
-            print("✅ Wuli Agent 就緒！")
-        return cls._instance
\ No newline at end of file
+    def warm_up(cls):
+        """啟動時預先建立所有角色的 Agent，讓第一個請求不用等初始化。"""
+        for is_admin in (True, False):
+            cls.get_executor(is_admin=is_admin)
+
+    @classmethod
+    def reset(cls):
+        """清掉快取 (例如設定變更後)，下次取用時會重新建立。"""
+        with cls._lock:
+            cls._executors.clear()
+
+
+def get_agent_executor(is_admin: bool = False):
+    """取得 (共用的) 對應角色 AgentExecutor。"""
+    return AgentRegistry.get_executor(is_admin=is_admin)
@@ -1,28 +1,38 @@
 import time
 import json
-import base64
-import mimetypes
 import os
-from typing import List, Any, Dict
+import asyncio
+from typing import List, Any, Dict, Optional, Tuple
 
 import gradio as gr
-import pypdf  # 需安裝 pypdf
-import docx   # 需安裝 python-docx
 from langchain_core.messages import HumanMessage, AIMessage
 
 # 引入模組
 from app.config import settings
 # from app.prompts import SYSTEM_PROMPT # 如果 llm_factory 已經處理了 Prompt，這裡可能不需要
-from app.llm_factory import build_agent_executor # 移除 AgentSingleton，直接用 build
+from app.llm_factory import get_agent_executor, AgentRegistry
 from app.ui.layout import create_demo
 from app.utils.logging import save_chat_log
+from app.utils.log_triage import triage_log_file
+from app.utils.documents import extract_document, submit_documents
+from app.utils.history import compact_history, message_parts, split_turns
+from app.utils.images import encode_image_cached
+from app.utils.sessions import session_store
+from app.utils.streaming import FrameCoalescer, content_to_text
+from app.utils.metrics import response_latency
+from app.fast_path import find_fast_path_card, render_card_answer, stream_card_answer
+from app.utils.concurrency import ConcurrencyLimiter, ServerBusyError, run_in_tool_executor
 from app.scheduler import start_scheduler, run_weekly_eol_scan
+from app.rag.retriever import ensure_rag_index
+from app.rag.prefetch import clear_card_prefetch, start_card_prefetch
+from app.rag.watcher import start_error_docs_watcher
 
 # ===================== 檔案讀取工具 (保持不變) =====================
 
-def read_file_content(file_path):
+def read_file_content(file_path, doc_key=None):
     """
     萬用檔案讀取器：根據副檔名決定怎麼讀取內容
+    (doc_key：submit_documents 事先送出解析時拿到的 key，可省掉重算檔案 hash)
     """
     if not file_path or not os.path.exists(file_path):
         return "", "error"
@@ -32,28 +42,26 @@ def read_file_content(file_path):
     content = ""
 
     try:
-        # 1. 處理純文字
-        if ext in ['.txt', '.log', '.py', '.js', '.md', '.json', '.csv', '.sh', '.yaml', '.yml']:
+        # 1. 大型 log：串流彙整成錯誤樣板摘要 (記憶體 / prompt 大小都和檔案大小無關)
+        if ext in ['.log', '.txt'] and os.path.getsize(file_path) > settings.LOG_TRIAGE_MIN_BYTES:
+            content = triage_log_file(file_path, filename)
+            return f"\n\n--- 📄 Log 彙整摘要 ({filename}) ---\n{content}\n--- 結束 ---\n", "text"
+
+        # 2. 處理純文字
+        elif ext in ['.txt', '.log', '.py', '.js', '.md', '.json', '.csv', '.sh', '.yaml', '.yml']:
             with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
                 content = f.read()
             return f"\n\n--- 📄 檔案內容 ({filename}) ---\n{content}\n--- 結束 ---\n", "text"
         
-        # 2. 處理 Word
-        elif ext == '.docx':
-            doc = docx.Document(file_path)
-            content = "\n".join([para.text for para in doc.paragraphs])
-            return f"\n\n--- 📄 Word 文件內容 ({filename}) ---\n{content}\n--- 結束 ---\n", "text"
-            
-        # 3. 處理 PDF
-        elif ext == '.pdf':
-            reader = pypdf.PdfReader(file_path)
-            texts = []
-            for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    texts.append(extracted)
-            content = "\n".join(texts)
-            return f"\n\n--- 📄 PDF 文件內容 ({filename}) ---\n{content}\n--- 結束 ---\n", "text"
+        # 3. 處理 Word / PDF (在 process pool 裡解析、有頁數 / 字數 / 時間上限、依內容 hash 快取)
+        elif ext in ['.docx', '.pdf']:
+            doc = extract_document(file_path, doc_key)
+            label = "Word" if ext == '.docx' else "PDF"
+            note = ""
+            if doc.truncated:
+                read = f"，已讀 {doc.pages}/{doc.total_pages} 頁" if doc.total_pages else ""
+                note = f"\n[系統提示: 文件過大或解析過久 ({doc.truncated}{read})，以下只包含部分內容]"
+            return f"\n\n--- 📄 {label} 文件內容 ({filename}) ---{note}\n{doc.text}\n--- 結束 ---\n", "text"
             
         # 4. 圖片
         elif ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp']:
@@ -68,71 +76,142 @@ def read_file_content(file_path):
 # ===================== 圖片處理工具 (保持不變) =====================
 
 def encode_image(image_path):
-    """將圖片檔案轉為 Base64 字串"""
-    if not image_path or not os.path.exists(image_path):
-        return None, None
-        
-    mime_type, _ = mimetypes.guess_type(image_path)
-    if not mime_type:
-        mime_type = "image/jpeg"
-        
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        
-    return mime_type, encoded_string
+    """
+    將圖片檔案轉為 Base64 字串
+    (經過快取：長邊縮到 IMAGE_MAX_SIDE 並重新壓縮，同一張圖只處理一次，見 app/utils/images.py)
+    """
+    return encode_image_cached(image_path)
 
-def process_history_for_langchain(gradio_history: List[Any]) -> List[Any]:
+def process_history_for_langchain(gradio_history: List[Any], session_id: Optional[str] = None) -> List[Any]:
     """
     將 Gradio 的歷史紀錄清洗為 LangChain/Bedrock 可接受的格式
+
+    先依 HISTORY_TOKEN_BUDGET 壓縮 (見 app/utils/history.py)：最近幾輪原封不動，
+    更早的對話換成摘要 (附件只留檔名)，摘要放在第一則保留的使用者訊息前面。
+
+    有 session_id 時改用伺服器端記住的對話狀態 (見 app/utils/sessions.py)：
+    每輪只處理前端新送來的訊息，轉好的 LangChain 訊息直接沿用。
     """
+    if not gradio_history or not isinstance(gradio_history[0], dict):
+        return []
+
+    if session_id:
+        with session_store.session(session_id) as state:
+            added = state.sync(gradio_history)
+            if added == len(gradio_history) and added > 1:
+                print(f"🗂️ [Session] 建立 / 重建對話狀態 ({len(gradio_history)} 則訊息)")
+            compacted = state.compact()
+            first_kept = len(state.turns) - compacted.kept_turns
+            state.drop_converted_before(first_kept)
+            langchain_history = build_history_messages(
+                compacted,
+                [state.turns[first_kept + i] for i in range(compacted.kept_turns)],
+                lambda i, keep_images: state.converted_turn(first_kept + i, keep_images, convert_history_turn),
+            )
+    else:
+        compacted = compact_history(gradio_history)
+        kept_turns = split_turns(compacted.messages)
+        langchain_history = build_history_messages(
+            compacted,
+            kept_turns,
+            lambda i, keep_images: convert_history_turn(kept_turns[i], keep_images),
+        )
+
+    if compacted.saved_tokens:
+        print(
+            f"🧹 [History] 壓縮 {len(gradio_history)} → {len(compacted.messages)} 則訊息 (+摘要) | "
+            f"約 {compacted.original_tokens} → {compacted.compacted_tokens} tokens "
+            f"(省 {compacted.saved_tokens})"
+        )
+    return langchain_history
+
+
+def build_history_messages(compacted, kept_turns: List[List[dict]], convert_turn) -> List[Any]:
+    """依序轉換保留的輪次；圖片只保留最近 IMAGE_HISTORY_MAX_TURNS 輪 (更早的換成文字佔位，省下最大宗的 payload)。"""
     langchain_history = []
-    
-    if not gradio_history:
-        return langchain_history
-
-    # (這裡保持原本邏輯不變)
-    if isinstance(gradio_history[0], dict):
-        for msg in gradio_history:
-            role = msg.get("role")
-            content_raw = msg.get("content")
-            final_content = []
-            
-            if isinstance(content_raw, str):
-                final_content = content_raw
-            
-            elif isinstance(content_raw, list):
-                for item in content_raw:
-                    if isinstance(item, dict) and item.get("type") == "text":
-                        final_content.append({"type": "text", "text": item.get("text")})
-                    
-                    elif isinstance(item, dict) and item.get("type") in ["file", "image"]:
-                        file_path = item.get("url") or item.get("path")
-                        if file_path:
-                            ext = os.path.splitext(file_path)[1].lower()
-                            if ext in ['.jpg', '.jpeg', '.png', '.webp']:
-                                m_type, b64_str = encode_image(file_path)
-                                if b64_str:
-                                    final_content.append({
-                                        "type": "image_url",
-                                        "image_url": {"url": f"data:{m_type};base64,{b64_str}"}
-                                    })
-                                else:
-                                    final_content.append({"type": "text", "text": "[歷史圖片已過期]"})
-                            else:
-                                pass 
-
-            if role == "user":
-                langchain_history.append(HumanMessage(content=final_content))
-            elif role == "assistant":
-                langchain_history.append(AIMessage(content=final_content))
-                
+    for idx in range(len(kept_turns)):
+        keep_images = len(kept_turns) - idx <= settings.IMAGE_HISTORY_MAX_TURNS
+        langchain_history.extend(convert_turn(idx, keep_images))
+
+    if compacted.summary:
+        langchain_history = prepend_history_summary(langchain_history, compacted.summary)
     return langchain_history
 
+
+def convert_history_turn(turn: List[dict], keep_images: bool) -> List[Any]:
+    """把一輪 Gradio 訊息轉成 LangChain 訊息。"""
+    messages = []
+    for msg in turn:
+        role = msg.get("role")
+        content_raw = msg.get("content")
+        final_content = []
+
+        if isinstance(content_raw, str):
+            final_content = content_raw
+
+        elif isinstance(content_raw, list):
+            for item in content_raw:
+                if isinstance(item, dict) and item.get("type") == "text":
+                    final_content.append({"type": "text", "text": item.get("text")})
+
+                elif isinstance(item, dict) and item.get("type") in ["file", "image"]:
+                    file_path = item.get("url") or item.get("path")
+                    if file_path:
+                        final_content.extend(history_image_blocks(file_path, keep_images))
+
+        elif isinstance(content_raw, (dict, tuple)):
+            # 單獨一則的附件訊息 (Gradio 的 FileMessage)
+            for file_path in message_parts(content_raw)[1]:
+                final_content.extend(history_image_blocks(file_path, keep_images))
+
+        if role == "user":
+            messages.append(HumanMessage(content=final_content))
+        elif role == "assistant":
+            messages.append(AIMessage(content=final_content))
+    return messages
+
+
+def history_image_blocks(file_path: str, keep_image: bool) -> List[dict]:
+    """歷史紀錄裡的附件：圖片轉成 (快取過的) image_url block，太舊的圖片換成文字佔位；其他附件略過。"""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in ['.jpg', '.jpeg', '.png', '.webp']:
+        return []
+    if not keep_image:
+        return [{"type": "text", "text": f"[歷史圖片已省略: {os.path.basename(file_path)}]"}]
+    m_type, b64_str = encode_image(file_path)
+    if b64_str:
+        return [{"type": "image_url", "image_url": {"url": f"data:{m_type};base64,{b64_str}"}}]
+    return [{"type": "text", "text": "[歷史圖片已過期]"}]
+
+
+def prepend_history_summary(messages: List[Any], summary: str) -> List[Any]:
+    """把舊對話摘要放進第一則使用者訊息 (不另外插 system message，Bedrock 只接受開頭的 system)。"""
+    if messages and isinstance(messages[0], HumanMessage):
+        first = messages[0]
+        if isinstance(first.content, list):
+            content = [{"type": "text", "text": summary}] + first.content
+        else:
+            content = f"{summary}\n\n{first.content}"
+        return [HumanMessage(content=content)] + messages[1:]
+    return [HumanMessage(content=summary)] + messages
+
 # ===================== 邏輯處理區 (權限核心修改) =====================
 
-def respond(message: dict, history: List[Any], request: gr.Request):
+# 對話請求的並發控制：全域 / 每位使用者的上限 + 排隊 (見 app/utils/concurrency.py)
+chat_limiter = ConcurrencyLimiter(
+    max_concurrent=settings.CHAT_MAX_CONCURRENCY,
+    per_user=settings.CHAT_MAX_CONCURRENCY_PER_USER,
+    max_waiting=settings.CHAT_MAX_WAITING,
+    wait_timeout=settings.CHAT_QUEUE_TIMEOUT,
+)
+
+
+async def respond(message: dict, history: List[Any], request: gr.Request):
     """
     處理對話邏輯：支援多模態輸入 + 權限控管
+
+    async generator：等待 LLM / 工具時不佔用 worker thread，
+    同步的工具與組 Agent 輸入 (讀檔 / 編碼圖片) 會明確丟到專用的 thread pool (TOOL_THREAD_WORKERS) 執行。
     """
     
     # 1. 🔥 身份識別與權限判斷
@@ -144,13 +223,38 @@ def respond(message: dict, history: List[Any], request: gr.Request):
 
     # 判斷是否為管理員 (根據 app/config.py 設定)
     is_admin = username in settings.ADMIN_USERS
-    
-    # 2. 🔥 根據權限，現場建立對應的 Agent (不再使用全域變數)
-    # 這裡的 current_agent 會根據 is_admin 拿到不同的工具箱
-    current_agent = build_agent_executor(is_admin=is_admin)
-    
+
+    # 伺服器端對話狀態的 key (每個瀏覽器分頁一個 session；加上帳號避免不同使用者撞 key)
+    session_hash = getattr(request, "session_hash", None) if request else None
+    session_id = f"{username}:{session_hash}" if session_hash else None
+
+    if chat_limiter.busy(username) and not chat_limiter.full():
+        yield "⏳ 現在找 Wuli 的人有點多，排隊中，請稍候..."
+
+    try:
+        async with chat_limiter.slot(username):
+            # 延遲統計從拿到名額開始算 (不含排隊時間)
+            trace = {"path": "agent"}
+            started = time.perf_counter()
+            first_frame = None
+            async for frame in run_agent(message, history, username, is_admin, trace, session_id):
+                if first_frame is None:
+                    first_frame = time.perf_counter() - started
+                yield frame
+            response_latency.record(trace["path"], time.perf_counter() - started, first_frame)
+            print(f"⏱️ {response_latency.format_line(trace['path'])}")
+    except ServerBusyError as e:
+        print(f"🚦 拒絕請求 ({username}): {e} | {chat_limiter.stats()}")
+        yield "😿 現在找 Wuli 的人太多了，請稍等一下再試一次！"
+
+
+def build_agent_input(message: dict, history: List[Any], session_id: Optional[str] = None) -> Tuple[dict, str]:
+    """
+    清洗歷史紀錄 + 解析本次輸入 (檔案 / 圖片)，組出 Agent 的輸入。
+    會讀檔、轉 base64，屬於阻塞操作，async 路徑上請丟到 thread 執行。
+    """
     # 3. 清洗歷史紀錄
-    chat_history = process_history_for_langchain(history)
+    chat_history = process_history_for_langchain(history, session_id)
     
     # 4. 準備本次的使用者輸入
     user_content = []
@@ -163,8 +267,10 @@ def respond(message: dict, history: List[Any], request: gr.Request):
         files = message.get("files", [])
         
         if files:
+            # 多份文件先一起送進 process pool 平行解析，下面再依序取結果
+            doc_keys = submit_documents(files)
             for file_path in files:
-                content, file_type = read_file_content(file_path)
+                content, file_type = read_file_content(file_path, doc_keys.get(file_path))
                 if file_type == "text":
                     text_input += content
                 elif file_type == "error":
@@ -204,66 +310,115 @@ def respond(message: dict, history: List[Any], request: gr.Request):
         "user_message": [input_message],
         "chat_history": chat_history,
     }
+    return input_data, raw_text_input
+
 
-    print(f"🚀 [Debug] User: {username} (Admin: {is_admin}) | Input: {len(raw_text_input)} chars")
+async def run_agent(message: dict, history: List[Any], username: str, is_admin: bool, trace: dict, session_id: Optional[str] = None):
+    """
+    執行這一輪對話並逐步回傳畫面；trace["path"] 會記錄實際走的路徑 (agent / fast_llm / fast_template)。
+    """
+    # 2. 🔥 根據權限，從註冊表取得對應的 Agent (每個角色只會建立一次，所有請求共用)
+    # 這裡的 current_agent 會根據 is_admin 拿到不同的工具箱
+    current_agent = get_agent_executor(is_admin=is_admin)
 
     # 6. 執行與回傳
+    # astream_events 會即時送出 LLM 的 token 與工具事件，
+    # 這裡每隔 STREAM_FRAME_INTERVAL 秒把累積的文字送一次給畫面
+    frames = FrameCoalescer(settings.STREAM_FRAME_INTERVAL)
+
     try:
-        # 🔥 修正重點：使用 current_agent 執行，而不是 agent_executor
-        for chunk in current_agent.stream(input_data):
-            
-            if "actions" in chunk:
-                for action in chunk["actions"]:
-                    # 根據工具名稱顯示不同訊息
-                    tool_name = action.tool
-                    if tool_name == "search_error_cards":
-                        yield "🐾 Wuli 正在翻閱維運手冊..."
-                    elif tool_name == "search_litellm_logs":
-                         yield "🔍 Wuli 正在潛入資料庫查 Log..."
-                    elif tool_name == "verify_prompt_with_guardrails":
-                         yield "🛡️ Wuli 正在進行安全檢查..."
-                    elif tool_name == "send_email_to_engineer":
-                         yield "📧 Wuli 正在寫信給工程師..."
-                    elif tool_name == "report_issue_to_jira":
-                         yield "🎫 Wuli 正在建立 Jira 卡片..."
-                    elif tool_name == "web_search_technical_solution":
-                         yield "🌐 內部查無資料，Wuli 正在搜尋外部網站解答中..."
-                    else:
-                        yield f"🤖 Wuli 正在使用工具: {tool_name}..."
-            
-            if "output" in chunk:
-                final_answer = chunk["output"]
-                
-                if isinstance(final_answer, list):
-                    text_parts = []
-                    for block in final_answer:
-                        if isinstance(block, dict) and "text" in block:
-                            text_parts.append(block["text"])
-                        elif isinstance(block, str):
-                            text_parts.append(block)
-                    final_answer = "".join(text_parts)
-                
-                final_answer = str(final_answer)
-
-                if not final_answer.strip():
-                    final_answer = "✅ 分析完成！(但 Wuli 看得太入迷忘記說話了 😺)"
-
-                yield "" 
-
-                partial_message = ""
-                for char in final_answer:
-                    partial_message += char
-                    yield partial_message
-                    time.sleep(0.005)
-
-                save_chat_log(message, final_answer)
+        input_data, raw_text_input = await run_in_tool_executor(build_agent_input, message, history, session_id)
+        print(f"🚀 [Debug] User: {username} (Admin: {is_admin}) | Input: {len(raw_text_input)} chars")
+
+        # ⚡ 快速路徑：對話第一輪且 patterns 明確命中單一張卡片 → 一次精簡 LLM 呼叫 (或直接回傳卡片)，不跑 Agent 迴圈
+        card = find_fast_path_card(
+            raw_text_input,
+            has_images=has_image_content(input_data["user_message"]),
+            has_history=bool(input_data["chat_history"]),
+        )
+
+        if card is not None:
+            trace["path"] = f"fast_{settings.FAST_PATH_MODE}"
+            print(f"⚡ [Fast Path] 命中卡片 {card.id} ({settings.FAST_PATH_MODE})")
+            try:
+                async for delta in stream_card_answer(card, raw_text_input):
+                    frame = frames.push(delta)
+                    if frame is not None:
+                        yield frame
+                final_output = frames.text
+            except Exception as e:
+                print(f"⚠️ 快速路徑 LLM 呼叫失敗，改回傳卡片原文: {e}")
+                final_output = render_card_answer(card)
+
+        else:
+            # 🔮 預先檢索：和第一次 LLM 呼叫同時進行 (不等結果、不呼叫 embedding)，
+            # 模型接著呼叫 search_error_cards 查同一件事時直接拿這份結果，省掉一輪檢索
+            start_card_prefetch(raw_text_input)
+            final_output = None
+            try:
+                async for event in current_agent.astream_events(input_data, version="v2"):
+                    kind = event["event"]
+
+                    if kind == "on_chat_model_stream":
+                        delta = content_to_text(getattr(event["data"].get("chunk"), "content", None))
+                        frame = frames.push(delta) if delta else None
+                        if frame is not None:
+                            yield frame
+
+                    elif kind == "on_tool_start":
+                        # 這一輪的文字只是呼叫工具前的草稿，換成工具狀態訊息
+                        frames.reset()
+                        yield tool_status_message(event["name"])
+
+                    elif kind == "on_chain_end" and not event.get("parent_ids"):
+                        # 最外層 (AgentExecutor) 結束
+                        final_output = (event["data"].get("output") or {}).get("output")
+            finally:
+                clear_card_prefetch()
+
+        final_answer = content_to_text(final_output)
+
+        if not final_answer.strip():
+            final_answer = "✅ 分析完成！(但 Wuli 看得太入迷忘記說話了 😺)"
+
+        # 以最終輸出為準 (和串流內容相同時畫面不會有變化)
+        yield final_answer
+        await asyncio.to_thread(save_chat_log, message, final_answer)
 
     except Exception as e:
         error_msg = f"😿 嗚... Wuli 的眼睛好像花了：{str(e)}"
         print(f"❌ Error Details: {e}")
-        save_chat_log(message, error_msg)
+        await asyncio.to_thread(save_chat_log, message, error_msg)
         yield error_msg
-        
+
+
+def has_image_content(messages: List[Any]) -> bool:
+    for msg in messages:
+        content = getattr(msg, "content", None)
+        if isinstance(content, list) and any(
+            isinstance(item, dict) and item.get("type") == "image_url" for item in content
+        ):
+            return True
+    return False
+
+
+def tool_status_message(tool_name: str) -> str:
+    """根據工具名稱顯示不同訊息"""
+    if tool_name == "search_error_cards":
+        return "🐾 Wuli 正在翻閱維運手冊..."
+    elif tool_name == "search_litellm_logs":
+        return "🔍 Wuli 正在潛入資料庫查 Log..."
+    elif tool_name == "verify_prompt_with_guardrails":
+        return "🛡️ Wuli 正在進行安全檢查..."
+    elif tool_name == "send_email_to_engineer":
+        return "📧 Wuli 正在寫信給工程師..."
+    elif tool_name == "report_issue_to_jira":
+        return "🎫 Wuli 正在建立 Jira 卡片..."
+    elif tool_name == "web_search_technical_solution":
+        return "🌐 內部查無資料，Wuli 正在搜尋外部網站解答中..."
+    else:
+        return f"🤖 Wuli 正在使用工具: {tool_name}..."
+
 # ===================== Feedback 處理區 (保持不變) =====================
 
 def clean_content(content):
@@ -315,9 +470,16 @@ def update_login_info(request: gr.Request):
 
 if __name__ == "__main__":
 
+    # 0. 建立 (或沿用既有的) 錯誤卡片索引，並在背景監看 error_docs/ 的變動
+    ensure_rag_index()
+    start_error_docs_watcher()
+
     # 1. 啟動排程
     start_scheduler()
 
+    # 1.5 預先建立 admin / user 兩種 Agent，之後每個請求直接共用
+    AgentRegistry.warm_up()
+
     # 2. 建立 UI
     demo = create_demo(respond_fn=respond, feedback_fn=on_feedback)
 
@@ -325,6 +487,13 @@ if __name__ == "__main__":
     print(f"🔒 Wuli Agent 安全模式啟動")
     print(f"   - Admin Users: {settings.ADMIN_USERS}")
     
+    # respond 是 async generator，不佔 worker thread：Gradio 端不限制並發，
+    # 改由 chat_limiter 控制 (全域 / 每位使用者上限 + 排隊)；max_size 是最外層的保險
+    demo.queue(
+        default_concurrency_limit=None,
+        max_size=settings.CHAT_MAX_CONCURRENCY + settings.CHAT_MAX_WAITING,
+    )
+
     # 請確保 settings.AUTHORIZED_USERS 格式為 [("帳號", "密碼"), ("帳號2", "密碼2")]
     demo.launch(
         server_name="127.0.0.1", 
@@ -0,0 +1,125 @@
+# app/rag/artifact.py
+import json
+import os
+import struct
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from .models import ErrorCard
+
+# 2：向量改存原始值 (format 1 存的是正規化過的向量，不能和 Chroma / embedding 快取混用)
+ARTIFACT_FORMAT = 2
+MANIFEST_FILE = "manifest.json"
+CARDS_FILE = "cards.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+
+# ZIP local file header 固定長度 (之後接檔名與 extra field)
+_LOCAL_HEADER_SIZE = 30
+
+
+class IndexArtifact:
+    """
+    預先建好的可攜式索引檔 (單一 zip)：
+    - manifest.json (壓縮)：格式版本、embedding 模型、ids、metadata (含 content_hash)
+    - cards.json    (壓縮)：解析好的 ErrorCard
+    - embeddings.npy (不壓縮 / ZIP_STORED)：embedding provider 回傳的原始 float32 向量 (不正規化，
+      和 Chroma / embedding 快取裡存的一樣)，這樣才能直接從 zip 裡 memory-map，不需要解壓、也不用呼叫 embedding provider
+    """
+
+    def __init__(self, path: str, manifest: dict, cards: List[ErrorCard], vectors: np.ndarray) -> None:
+        self.path = path
+        self.manifest = manifest
+        self.cards = cards
+        self.vectors = vectors
+
+    @property
+    def model_id(self) -> str:
+        return self.manifest.get("model_id", "")
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self.manifest["ids"])
+
+    @property
+    def metadatas(self) -> List[dict]:
+        return list(self.manifest["metadatas"])
+
+    def content_hashes(self) -> Dict[str, str]:
+        return {i: (m or {}).get("content_hash", "") for i, m in zip(self.ids, self.metadatas)}
+
+
+def export_index_artifact(path: str, collection, cards: List[ErrorCard], model_id: str) -> dict:
+    """
+    把目前的向量索引 (Chroma 裡已算好的向量) 與卡片打包成單一檔案。
+    """
+    data = collection.get(include=["embeddings", "metadatas"])
+    ids = list(data["ids"])
+    metadatas = list(data.get("metadatas") or [{}] * len(ids))
+    embeddings = data.get("embeddings")
+    vectors = np.asarray(embeddings, dtype=np.float32) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "model_id": model_id,
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "count": len(ids),
+        "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "ids": ids,
+        "metadatas": metadatas,
+    }
+
+    out = Path(path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".tmp")
+    with zipfile.ZipFile(tmp, "w") as zf:
+        zf.writestr(MANIFEST_FILE, json.dumps(manifest, ensure_ascii=False), compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr(
+            CARDS_FILE,
+            json.dumps([c.model_dump() for c in cards], ensure_ascii=False),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+        info = zipfile.ZipInfo(EMBEDDINGS_FILE, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        with zf.open(info, "w", force_zip64=True) as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+    os.replace(tmp, out)
+
+    return {"path": str(out), "count": len(ids), "dim": manifest["dim"], "model_id": model_id}
+
+
+def open_index_artifact(path: str) -> IndexArtifact:
+    """
+    開啟索引檔：manifest / cards 直接讀進來，embeddings 以 memory-map 方式對應到 zip 內的位置。
+    """
+    with zipfile.ZipFile(path) as zf:
+        manifest = json.loads(zf.read(MANIFEST_FILE).decode("utf-8"))
+        if manifest.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"不支援的索引檔格式: {manifest.get('format')}")
+        cards = [ErrorCard(**c) for c in json.loads(zf.read(CARDS_FILE).decode("utf-8"))]
+        info = zf.getinfo(EMBEDDINGS_FILE)
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError("embeddings.npy 必須以不壓縮方式存放才能 memory-map")
+
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        header = f.read(_LOCAL_HEADER_SIZE)
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        f.seek(info.header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len)
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if 0 in shape:
+        vectors = np.zeros(shape, dtype=dtype)
+    else:
+        vectors = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                            order="F" if fortran_order else "C")
+    return IndexArtifact(path, manifest, cards, vectors)
@@ -0,0 +1,108 @@
+# app/rag/card_store.py
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from .models import ErrorCard
+from .error_card_loader import load_error_card
+from .matcher import PatternMatcher
+from .lexical import BM25Index
+from .chunking import CardSection, split_card_sections
+from .query_parser import QueryParser
+
+
+class CardSnapshot:
+    """
+    某個時間點的卡片集合 (不可變)。
+    查詢端拿到 snapshot 後就不用加鎖，重新載入時會整個換成新的 snapshot。
+    """
+
+    def __init__(self, version: int, cards: List[ErrorCard]) -> None:
+        self.version = version
+        self.cards: Tuple[ErrorCard, ...] = tuple(cards)
+        self.by_id: Dict[str, ErrorCard] = {c.id: c for c in self.cards}
+        # 所有 patterns 預先編譯成一個自動機，每個 snapshot 只建一次
+        self.matcher = PatternMatcher(self.cards)
+        # 卡片內容 + tags 的 BM25 字詞索引，同樣跟著 snapshot 一起建
+        self.lexical = BM25Index(self.cards)
+        # 每張卡片切好的段落 (給檢索結果挑段落用)
+        self.sections: Dict[str, List[CardSection]] = {c.id: split_card_sections(c) for c in self.cards}
+        # 狀態碼 / 錯誤代碼 / 元件的 regex 前處理
+        self.parser = QueryParser(self.cards)
+
+
+class CardStore:
+    """
+    行程內共用的 Error Card 快取。
+
+    - 保存已解析的 ErrorCard，只有 mtime 或 size 變動的檔案才會重新讀取 / YAML 解析
+    - 新增 / 修改 / 刪除卡片都會在下一次 refresh 反映出來 (不需重啟服務)
+    - refresh 由重建索引的流程觸發 (啟動、app.rag.watcher 偵測到 error_docs 變動)，
+      查詢路徑上只讀目前的 snapshot，不做任何檔案 I/O
+    """
+
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = root_dir
+        # path -> (mtime_ns, size, card)
+        self._entries: Dict[str, Tuple[int, int, ErrorCard]] = {}
+        self._snapshot = CardSnapshot(0, [])
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def refresh(self) -> bool:
+        """
+        重新 stat error_docs/，回傳卡片內容是否有變動。
+        """
+        with self._lock:
+            root_path = Path(self.root_dir)
+            seen = set()
+            changed = False
+
+            paths = sorted(root_path.rglob("*.md")) if root_path.exists() else []
+            for path in paths:
+                key = str(path)
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue  # 掃描途中被刪掉
+
+                seen.add(key)
+                old = self._entries.get(key)
+                if old and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+                    continue
+
+                try:
+                    card = load_error_card(path)
+                except Exception as e:
+                    print(f"⚠️ 卡片解析失敗，略過 {key}: {e}")
+                    if old:
+                        del self._entries[key]
+                        changed = True
+                    continue
+
+                self._entries[key] = (st.st_mtime_ns, st.st_size, card)
+                changed = True
+
+            for key in [k for k in self._entries if k not in seen]:
+                del self._entries[key]
+                changed = True
+
+            if changed or self._snapshot.version == 0:
+                cards = [self._entries[k][2] for k in sorted(self._entries)]
+                self._snapshot = CardSnapshot(self._snapshot.version + 1, cards)
+
+            return changed
+
+    def snapshot(self, force_refresh: bool = False) -> CardSnapshot:
+        """
+        取得目前的 snapshot；只有第一次 (還沒載入過) 或 force_refresh 時才會掃描 error_docs/。
+        """
+        if force_refresh or self._snapshot.version == 0:
+            self.refresh()
+        return self._snapshot
+
+    def get_cards(self, force_refresh: bool = False) -> List[ErrorCard]:
+        return list(self.snapshot(force_refresh=force_refresh).cards)
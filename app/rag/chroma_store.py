@@ -1,7 +1,11 @@
 # app/rag/chroma_store.py
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
 import os
+import threading
+import time
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -13,14 +17,30 @@ from chromadb.utils import embedding_functions
 
 from app.config import settings
 from .models import ErrorCard
+from .embedding_cache import get_embedding_cache, text_hash
+from .chunking import CardSection, section_embedding_text, split_card_sections
 
 
 CHROMA_DIR = "./chroma_db"
 
+# 建立 collection 時的設定 (None = Chroma 預設：HNSW + L2 距離)；scripts/bench_vector_backends.py 也用這個
+COLLECTION_METADATA: Optional[dict] = None
+
+# 行程內共用的 client / embedding function / collection handle
+# (避免每次查詢都重新開 SQLite、重新建立 provider 的 HTTP client)
+_handles_lock = threading.RLock()
+_client = None
+_emb_fn = None
+# collection 名稱 -> (指標檔 mtime, 版本名稱, handle)
+_collections: Dict[str, tuple] = {}
+
 class LangChainOpenAIEmbeddingFunction(embedding_functions.EmbeddingFunction):
     """
     用 langchain-openai 的 Embeddings 當作 Chroma 的 embedding_function。
     會根據環境變數決定走 OpenAI 還是 Azure OpenAI。
+
+    前面墊一層本機 embedding 快取 (EMBEDDING_CACHE_PATH)：
+    只有快取沒命中的文字才會分批送到 provider。
     """
 
     def __init__(self) -> None:
@@ -28,8 +48,11 @@ class LangChainOpenAIEmbeddingFunction(embedding_functions.EmbeddingFunction):
             "LLM_PROVIDER", "azure"
         ).lower()
 
+        self.provider = provider
+
         if provider == "azure":
             # 這些環境變數請照你實際的 Azure 設定
+            self.model_name = settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT or ""
             self._emb = AzureOpenAIEmbeddings(
                 azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
                 api_key=settings.AZURE_OPENAI_API_KEY,
@@ -37,20 +60,64 @@ class LangChainOpenAIEmbeddingFunction(embedding_functions.EmbeddingFunction):
                 azure_deployment=settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT
             )
         elif provider == 'bedrock':
+            self.model_name = settings.BEDROCK_EMBEDDING_ID or ""
             self._emb = BedrockEmbeddings(
                 model_id=settings.BEDROCK_EMBEDDING_ID
             )
 
         else:
             # 預設走 OpenAI 公有雲
+            self.model_name = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
             self._emb = OpenAIEmbeddings(
                 api_key=os.environ["OPENAI_API_KEY"],
-                model=os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small"),
+                model=self.model_name,
             )
 
+        self._cache = get_embedding_cache(settings.EMBEDDING_CACHE_PATH)
+
+    @property
+    def model_id(self) -> str:
+        """provider + 模型名稱，例如 azure:text-embedding-3-small，用來判斷向量是否需要重算。"""
+        return f"{self.provider}:{self.model_name}"
+
     def __call__(self, texts: List[str]) -> List[List[float]]:
         # langchain 的 embed_documents 本來就吃 List[str]、回 List[List[float]]
-        return self._emb.embed_documents(texts)
+        texts = list(texts)
+        if self._cache is None:
+            return self._emb.embed_documents(texts)
+
+        hashes = [text_hash(t) for t in texts]
+        found = self._cache.get_many(self.provider, self.model_name, hashes)
+
+        # 沒命中的 (去重後) 才送 provider
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+
+        if missing:
+            batch_size = max(1, settings.EMBEDDING_BATCH_SIZE)
+            items = list(missing.items())
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                vectors = self._emb.embed_documents([t for _, t in batch])
+                new = {h: vec for (h, _), vec in zip(batch, vectors)}
+                self._cache.put_many(self.provider, self.model_name, new)
+                found.update(new)
+
+        self._cache.record(hits=len(texts) - len(missing), misses=len(missing))
+        return [found[h] for h in hashes]
+
+    def seed_cache(self, texts: List[str], vectors) -> int:
+        """把已知的 (文字, 向量) 寫進快取，例如從預建索引檔載入時；回傳寫入筆數。"""
+        if self._cache is None:
+            return 0
+        items = {text_hash(t): list(map(float, v)) for t, v in zip(texts, vectors)}
+        self._cache.put_many(self.provider, self.model_name, items)
+        return len(items)
+
+    def cache_stats(self) -> dict:
+        return self._cache.stats() if self._cache else {"hits": 0, "misses": 0, "hit_rate": 0.0}
 
 
 def build_client() -> chromadb.PersistentClient:
@@ -58,6 +125,16 @@ def build_client() -> chromadb.PersistentClient:
     return chromadb.PersistentClient(path=CHROMA_DIR)
 
 
+def get_client() -> chromadb.PersistentClient:
+    """行程內共用的 PersistentClient (第一次使用時才建立)。"""
+    global _client
+    if _client is None:
+        with _handles_lock:
+            if _client is None:
+                _client = build_client()
+    return _client
+
+
 # def build_embedding_function():
 #     """
 #     這裡先用 Chroma 內建的 sentence-transformers embedding。
@@ -76,51 +153,363 @@ def build_embedding_function():
     return LangChainOpenAIEmbeddingFunction()
 
 
-def index_error_cards(cards: List[ErrorCard], collection_name: str = "error_cards"):
-    client = build_client()
-    emb_fn = build_embedding_function()
+def get_embedding_function() -> LangChainOpenAIEmbeddingFunction:
+    """行程內共用的 embedding function (連同底下 provider SDK 的 client)。"""
+    global _emb_fn
+    if _emb_fn is None:
+        with _handles_lock:
+            if _emb_fn is None:
+                _emb_fn = build_embedding_function()
+    return _emb_fn
+
+
+def card_content_hash(card: ErrorCard) -> str:
+    """
+    卡片內容的 hash (frontmatter + 正文)。
+    path 不算在內：只是搬移檔案不需要重新 embedding。
+    """
+    payload = card.model_dump(exclude={"path"})
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def build_card_metadata(card: ErrorCard, content_hash: str, embedding_model: str) -> dict:
+    meta = {
+        "id": card.id,
+        "component": card.component,
+        "category": card.category,
+        "severity": card.severity or "",
+        "tags": ",".join(card.tags) if card.tags else "",
+        "path": card.path or "",
+        "content_hash": content_hash,
+        "embedding_model": embedding_model,
+    }
+
+    if card.http_status is not None:
+        meta["http_status"] = int(card.http_status)
+    if card.error_code is not None:
+        meta["error_code"] = str(card.error_code)
+
+    return meta
 
+
+# ===================== 版本化索引 (blue / green) =====================
+# 每次重建都寫進一個新的 "<name>__v<時間戳>" collection，
+# 建完之後才把 "<name>.current.json" 指標 (atomic os.replace) 切過去。
+# 查詢端永遠讀到一個完整的版本；上一版會保留下來，可以瞬間 rollback。
+
+VERSION_SEPARATOR = "__v"
+
+
+def _pointer_path(collection_name: str) -> Path:
+    return Path(CHROMA_DIR) / f"{collection_name}.current.json"
+
+
+def read_index_pointer(collection_name: str = "error_cards") -> dict:
+    """
+    讀取版本指標：{"current": 版本名稱, "history": [較舊的版本 (新 → 舊)]}。
+    沒有指標檔時 current 為 None。
+    """
+    path = _pointer_path(collection_name)
+    if not path.exists():
+        return {"current": None, "history": []}
     try:
-        collection = client.get_collection(collection_name, embedding_function=emb_fn)
+        data = json.loads(path.read_text(encoding="utf-8"))
     except Exception:
-        collection = client.create_collection(collection_name, embedding_function=emb_fn)
+        return {"current": None, "history": []}
+    return {"current": data.get("current"), "history": list(data.get("history") or [])}
+
+
+def _write_index_pointer(collection_name: str, current: str, history: List[str]) -> None:
+    path = _pointer_path(collection_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(
+        json.dumps({"current": current, "history": history, "switched_at": time.time()}, ensure_ascii=False),
+        encoding="utf-8",
+    )
+    os.replace(tmp, path)
+
+
+def _new_version_name(collection_name: str) -> str:
+    return f"{collection_name}{VERSION_SEPARATOR}{time.strftime('%Y%m%d%H%M%S')}{int(time.time() * 1000) % 1000:03d}"
+
+
+def _resolve_current_name(collection_name: str) -> Optional[str]:
+    """目前生效的 collection 名稱 (相容舊版：沒有指標但有同名 collection)。"""
+    current = read_index_pointer(collection_name)["current"]
+    if current:
+        return current
+    try:
+        get_client().get_collection(collection_name)
+        return collection_name
+    except Exception:
+        return None
+
+
+def _copy_entries(source, target, ids: List[str], batch_size: int = 1000) -> None:
+    """把 ids 連同「已經算好的 embedding」從舊版本複製到新版本，不會呼叫 embedding API。"""
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        data = source.get(ids=batch, include=["embeddings", "documents", "metadatas"])
+        if not data["ids"]:
+            continue
+        target.add(
+            ids=list(data["ids"]),
+            embeddings=data["embeddings"],
+            documents=data["documents"],
+            metadatas=data["metadatas"],
+        )
+
+
+def _gc_old_versions(collection_name: str, keep: List[str]) -> None:
+    client = get_client()
+    prefix = collection_name + VERSION_SEPARATOR
+    for col in client.list_collections():
+        name = col if isinstance(col, str) else col.name
+        is_ours = name == collection_name or name.startswith(prefix)
+        if is_ours and name not in keep:
+            try:
+                client.delete_collection(name)
+                print(f"🧹 刪除舊版索引 {name}")
+            except Exception as e:
+                print(f"⚠️ 刪除舊版索引 {name} 失敗: {e}")
+
 
-    existing = collection.count()
-    if existing > 0:
-        collection.delete(ids=collection.get()["ids"])
+def build_section_metadata(card: ErrorCard, section: CardSection, chunk_hash: str, embedding_model: str) -> dict:
+    meta = build_card_metadata(card, chunk_hash, embedding_model)
+    meta.update({
+        "parent_id": card.id,
+        "section_index": section.index,
+        "section_title": section.title,
+        "section_kind": section.kind,
+    })
+    return meta
 
+
+def index_error_cards(cards: List[ErrorCard], collection_name: str = "error_cards") -> Tuple[object, Dict[str, int]]:
+    """
+    增量 + 版本化更新索引：
+    - 每張卡片依標題 / 「通常代表：」「建議：」標籤 / code block 切成段落，
+      每個段落是一筆 chunk (id 為 "<card_id>#<序號>"，metadata 的 parent_id 指回卡片)
+    - 每個 chunk 的 metadata 會記錄 content_hash 與 embedding_model
+    - 和目前版本比對：只有新增 / 內容變動 / 換了 embedding 模型的卡片會重新 embedding
+      (內容沒變的段落會從 embedding 快取拿，不會呼叫 API)
+    - 沒有任何變動 → 直接沿用目前版本，不建新版
+    - 有變動 → 建立新版本 collection (沒變的卡片直接複製舊向量)，全部寫完才切換指標；
+      中途失敗會刪掉半成品，目前版本完全不受影響
+    - 保留 INDEX_KEEP_VERSIONS 個版本 (含目前版本) 供 rollback，更舊的會被清掉
+
+    回傳 (collection, stats)，stats 為「卡片」層級的 added / updated / removed / unchanged 數量。
+    """
+    client = get_client()
+    emb_fn = get_embedding_function()
+    model_id = emb_fn.model_id
+
+    current_name = _resolve_current_name(collection_name)
+    current = None
+    # parent card id -> {chunk_id: (content_hash, embedding_model)}
+    existing_chunks: Dict[str, Dict[str, tuple]] = {}
+    if current_name:
+        current = client.get_collection(current_name, embedding_function=emb_fn)
+        existing = current.get(include=["metadatas"])
+        for chunk_id, meta in zip(existing["ids"], existing["metadatas"] or []):
+            meta = meta or {}
+            parent = meta.get("parent_id") or meta.get("id") or chunk_id
+            existing_chunks.setdefault(parent, {})[chunk_id] = (
+                meta.get("content_hash"),
+                meta.get("embedding_model"),
+            )
+
+    stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
     ids = []
-    texts = []
+    documents = []
+    embed_texts = []
     metadatas = []
+    unchanged_ids = []
+    seen = set()
 
     for card in cards:
-        ids.append(card.id)
-        texts.append(card.content)
+        if card.id in seen:
+            print(f"⚠️ 重複的卡片 id {card.id} ({card.path})，略過")
+            continue
+        seen.add(card.id)
+
+        card_hash = card_content_hash(card)
+        chunks = []
+        for section in split_card_sections(card):
+            text = section_embedding_text(card, section)
+            chunk_hash = hashlib.sha256(f"{card_hash}\n{text}".encode("utf-8")).hexdigest()
+            chunks.append((section, text, chunk_hash))
+
+        wanted = {section.chunk_id: (chunk_hash, model_id) for section, _, chunk_hash in chunks}
+        old = existing_chunks.get(card.id)
+
+        if old is None:
+            stats["added"] += 1
+        elif old != wanted:
+            stats["updated"] += 1
+        else:
+            stats["unchanged"] += 1
+            unchanged_ids.extend(wanted)
+            continue
 
-        meta = {
-            "id": card.id,
-            "component": card.component,
-            "category": card.category,
-            "severity": card.severity or "",
-            "tags": ",".join(card.tags) if card.tags else "",
-            "path": card.path or "",
-        }
+        for section, text, chunk_hash in chunks:
+            ids.append(section.chunk_id)
+            documents.append(section.text)
+            embed_texts.append(text)
+            metadatas.append(build_section_metadata(card, section, chunk_hash, model_id))
 
-        if card.http_status is not None:
-            meta["http_status"] = int(card.http_status)
-        if card.error_code is not None:
-            meta["error_code"] = str(card.error_code)
+    stats["removed"] = len([parent for parent in existing_chunks if parent not in seen])
 
-        metadatas.append(meta)
+    if current is not None and not (ids or stats["removed"]):
+        _cache_handle(collection_name, current_name, current)
+        return current, stats
 
-    if ids:
-        collection.add(ids=ids, documents=texts, metadatas=metadatas)
+    # --- 建立新版本 (green) ---
+    new_name = _new_version_name(collection_name)
+    collection = client.create_collection(new_name, embedding_function=emb_fn, metadata=COLLECTION_METADATA)
+    try:
+        if current is not None and unchanged_ids:
+            _copy_entries(current, collection, unchanged_ids)
+        if ids:
+            # embedding 用「卡片標題 + 段落」，documents 只存段落本身 (回給 LLM 的內容)
+            embeddings = emb_fn(embed_texts)
+            collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        expected = len(unchanged_ids) + len(ids)
+        if collection.count() != expected:
+            raise RuntimeError(f"新版本筆數不符 ({collection.count()} != {expected})")
+    except Exception:
+        client.delete_collection(new_name)
+        raise
+
+    _switch_version(collection_name, current_name, new_name, collection)
+    return collection, stats
+
+
+def _switch_version(collection_name: str, current_name: Optional[str], new_name: str, collection) -> None:
+    """切換指標 (blue → green)，並清掉超過保留數量的舊版本。"""
+    pointer = read_index_pointer(collection_name)
+    history = ([current_name] if current_name else []) + [h for h in pointer["history"] if h != current_name]
+    keep_versions = max(1, settings.INDEX_KEEP_VERSIONS)
+    history = history[:keep_versions - 1]
+    _write_index_pointer(collection_name, new_name, history)
+    _cache_handle(collection_name, new_name, collection)
+    print(f"🔀 索引 '{collection_name}' 切換至 {new_name}")
+
+    _gc_old_versions(collection_name, keep=[new_name] + history)
 
+
+def install_index_version(
+    collection_name: str,
+    ids: List[str],
+    embeddings,
+    documents: List[str],
+    metadatas: List[dict],
+    batch_size: int = 1000,
+):
+    """
+    用「已經算好的向量」建立一個新版本並切換過去 (例如從預先建好的索引檔匯入)，
+    完全不呼叫 embedding API。回傳新的 collection。
+    """
+    client = get_client()
+    current_name = _resolve_current_name(collection_name)
+    new_name = _new_version_name(collection_name)
+    collection = client.create_collection(
+        new_name, embedding_function=get_embedding_function(), metadata=COLLECTION_METADATA,
+    )
+    try:
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.add(
+                ids=list(ids[start:end]),
+                embeddings=[list(map(float, v)) for v in embeddings[start:end]],
+                documents=list(documents[start:end]),
+                metadatas=list(metadatas[start:end]),
+            )
+        if collection.count() != len(ids):
+            raise RuntimeError(f"新版本筆數不符 ({collection.count()} != {len(ids)})")
+    except Exception:
+        client.delete_collection(new_name)
+        raise
+
+    _switch_version(collection_name, current_name, new_name, collection)
     return collection
 
 
+def rollback_index(collection_name: str = "error_cards") -> Optional[str]:
+    """
+    切回上一個版本 (只改指標，不重新 embedding)。回傳切換後的版本名稱，沒有可用的舊版則回傳 None。
+    """
+    pointer = read_index_pointer(collection_name)
+    client = get_client()
+    for i, name in enumerate(pointer["history"]):
+        try:
+            collection = client.get_collection(name, embedding_function=get_embedding_function())
+        except Exception:
+            continue
+        history = [pointer["current"]] + pointer["history"][i + 1:] if pointer["current"] else pointer["history"][i + 1:]
+        _write_index_pointer(collection_name, name, history)
+        _cache_handle(collection_name, name, collection)
+        print(f"⏪ 索引 '{collection_name}' 已 rollback 至 {name}")
+        return name
+    return None
+
+
+def current_content_hashes(collection_name: str = "error_cards") -> Dict[str, str]:
+    """目前版本每張卡片的 content_hash (沒有索引時為空)。"""
+    current_name = _resolve_current_name(collection_name)
+    if not current_name:
+        return {}
+    collection = get_client().get_collection(current_name, embedding_function=get_embedding_function())
+    data = collection.get(include=["metadatas"])
+    return {i: (m or {}).get("content_hash", "") for i, m in zip(data["ids"], data["metadatas"] or [])}
+
+
+def index_pointer_version(collection_name: str = "error_cards") -> Optional[int]:
+    """指標檔的 mtime；其他行程切換版本時也會改變，可當作便宜的版本號。"""
+    return _pointer_mtime(collection_name)
+
+
+def _pointer_mtime(collection_name: str) -> Optional[int]:
+    try:
+        return _pointer_path(collection_name).stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _cache_handle(collection_name: str, version_name: str, collection) -> None:
+    with _handles_lock:
+        _collections[collection_name] = (_pointer_mtime(collection_name), version_name, collection)
+
 
 def get_collection(collection_name: str = "error_cards"):
-    client = build_client()
-    emb_fn = build_embedding_function()
-    return client.get_collection(collection_name, embedding_function=emb_fn)
+    """
+    取得目前版本的共用 collection handle。
+    只在指標檔變動 (本行程或其他行程，例如 scripts/rebuild_index.py 重建過) 時才重新取得，
+    平常只多一次 stat。
+    """
+    mtime = _pointer_mtime(collection_name)
+    cached = _collections.get(collection_name)
+    if cached is not None and cached[0] == mtime:
+        return cached[2]
+
+    with _handles_lock:
+        cached = _collections.get(collection_name)
+        if cached is None or cached[0] != mtime:
+            version_name = _resolve_current_name(collection_name) or collection_name
+            collection = get_client().get_collection(
+                version_name, embedding_function=get_embedding_function()
+            )
+            cached = (mtime, version_name, collection)
+            _collections[collection_name] = cached
+    return cached[2]
+
+
+def reset_collection_cache(collection_name: Optional[str] = None) -> None:
+    """丟掉快取的 collection handle，下次 get_collection() 會重新取得。"""
+    with _handles_lock:
+        if collection_name is None:
+            _collections.clear()
+        else:
+            _collections.pop(collection_name, None)
@@ -0,0 +1,116 @@
+# app/rag/chunking.py
+import re
+from typing import List, NamedTuple
+
+from .models import ErrorCard
+
+# Markdown 標題
+_HEADING = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+# 「通常代表：」「建議：」「給工程師的建議：」這類以冒號結尾的段落標籤 (清單項目除外)
+_LABEL = re.compile(r"^(?![-*+]\s|\d+[.)]\s).{1,120}[:：]\s*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+class CardSection(NamedTuple):
+    """
+    卡片的一個段落 (chunk)。
+    - chunk_id: "<card_id>#<序號>"
+    - title: 段落標題 (標題行 / 冒號標籤 / "code")
+    - text: 段落內容 (含標題行)，直接給 LLM 看
+    - kind: "text" 或 "code"
+    """
+    chunk_id: str
+    card_id: str
+    index: int
+    title: str
+    text: str
+    kind: str
+
+
+def chunk_id_for(card_id: str, index: int) -> str:
+    return f"{card_id}#{index}"
+
+
+def parent_id_of(chunk_id: str) -> str:
+    return chunk_id.rsplit("#", 1)[0]
+
+
+def card_title(card: ErrorCard) -> str:
+    """卡片第一個標題，沒有的話用 id。"""
+    for line in card.content.splitlines():
+        m = _HEADING.match(line)
+        if m:
+            return m.group(2)
+    return card.id
+
+
+def split_card_sections(card: ErrorCard) -> List[CardSection]:
+    """
+    依標題 / 冒號標籤 / code block 把卡片切成段落。
+    例如一般卡片會切成「# 標題」、「…通常代表：」、「建議：」、「給工程師的建議：」幾段，
+    code block 會獨立成一段。
+    """
+    blocks: List[tuple] = []  # (title, lines, kind)
+    title, lines, kind = "", [], "text"
+    in_code = False
+
+    def flush():
+        text = "\n".join(lines).strip()
+        if text:
+            blocks.append((title, text, kind))
+
+    for line in card.content.splitlines():
+        if _FENCE.match(line):
+            if not in_code:
+                flush()
+                title, lines, kind = "code", [line], "code"
+                in_code = True
+            else:
+                lines.append(line)
+                flush()
+                title, lines, kind = "", [], "text"
+                in_code = False
+            continue
+
+        if in_code:
+            lines.append(line)
+            continue
+
+        heading = _HEADING.match(line)
+        if heading or _LABEL.match(line.strip()):
+            flush()
+            title = heading.group(2) if heading else line.strip().rstrip(":：").strip()
+            lines, kind = [line], "text"
+            continue
+
+        lines.append(line)
+
+    flush()
+
+    # 只有一行標題 / 標籤、底下馬上接另一段的，併到下一段 (避免產生只有標題的 chunk)
+    merged: List[tuple] = []
+    for block in blocks:
+        if merged and merged[-1][2] == "text" and "\n" not in merged[-1][1]:
+            prev = merged.pop()
+            block = (block[0], f"{prev[1]}\n{block[1]}", block[2])
+        merged.append(block)
+    blocks = merged
+
+    if not blocks:
+        blocks = [(card.id, card.content.strip(), "text")]
+
+    return [
+        CardSection(chunk_id_for(card.id, i), card.id, i, t, text, k)
+        for i, (t, text, k) in enumerate(blocks)
+    ]
+
+
+def section_embedding_text(card: ErrorCard, section: CardSection) -> str:
+    """
+    拿去 embedding 的文字：在段落前面加上卡片標題，
+    讓「建議：」這種很短的段落也帶有是哪一種錯誤的語意。
+    """
+    title = card_title(card)
+    if section.text.startswith("#") or title in section.text:
+        return section.text
+    return f"{title}\n{section.text}"
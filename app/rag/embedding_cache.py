@@ -0,0 +1,108 @@
+# app/rag/embedding_cache.py
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    本機持久化的 embedding 快取 (SQLite)。
+    key = (provider, model, sha256(text))，value = 向量 (float32 blob，Chroma 內部也是 float32)。
+
+    同一段文字在同一個模型下只會付一次 embedding 的錢：
+    重建索引、重複查詢都直接從這裡拿。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                provider   TEXT NOT NULL,
+                model      TEXT NOT NULL,
+                text_hash  TEXT NOT NULL,
+                dim        INTEGER NOT NULL,
+                vector     BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (provider, model, text_hash)
+            )
+            """
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, provider: str, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite 預設單一語句最多 999 個參數，分批查
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE provider = ? AND model = ? AND text_hash IN ({placeholders})",
+                    (provider, model, *chunk),
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, provider: str, model: str, items: Dict[str, Sequence[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (provider, model, h, len(vec), array("f", vec).tobytes(), now)
+            for h, vec in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings "
+                "(provider, model, text_hash, dim, vector, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def record(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path: Optional[str]) -> Optional[EmbeddingCache]:
+    """
+    依路徑取得共用的快取實體；path 為空代表停用快取。
+    """
+    if not path:
+        return None
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = EmbeddingCache(path)
+        return cache
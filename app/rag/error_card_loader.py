@@ -25,33 +25,35 @@ def split_frontmatter(text: str) -> Tuple[dict, str]:
     return meta, body.strip()
 
 
+def load_error_card(path: Path) -> ErrorCard:
+    """
+    解析單一張 .md 卡片。
+    """
+    raw = path.read_text(encoding="utf-8")
+    meta, body = split_frontmatter(raw)
+
+    # 給些合理預設值
+    return ErrorCard(
+        id=meta.get("id", path.stem),
+        component=meta.get("component", "generic"),
+        category=meta.get("category", "error"),
+        http_status=meta.get("http_status"),
+        error_code=meta.get("error_code"),
+        severity=meta.get("severity", "medium"),
+        tags=meta.get("tags", []) or [],
+        patterns=meta.get("patterns", []) or [],
+        path=str(path),
+        content=body,
+    )
+
+
 def load_error_cards(root_dir: str) -> List[ErrorCard]:
     """
     掃描 error_docs/ 底下所有 .md，轉成 ErrorCard list。
     """
-    cards: List[ErrorCard] = []
     root_path = Path(root_dir)
 
     if not root_path.exists():
         return []
 
-    for path in root_path.rglob("*.md"):
-        raw = path.read_text(encoding="utf-8")
-        meta, body = split_frontmatter(raw)
-
-        # 給些合理預設值
-        card = ErrorCard(
-            id=meta.get("id", path.stem),
-            component=meta.get("component", "generic"),
-            category=meta.get("category", "error"),
-            http_status=meta.get("http_status"),
-            error_code=meta.get("error_code"),
-            severity=meta.get("severity", "medium"),
-            tags=meta.get("tags", []) or [],
-            patterns=meta.get("patterns", []) or [],
-            path=str(path),
-            content=body,
-        )
-        cards.append(card)
-
-    return cards
+    return [load_error_card(path) for path in root_path.rglob("*.md")]
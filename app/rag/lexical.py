@@ -0,0 +1,119 @@
+# app/rag/lexical.py
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+from .models import ErrorCard
+
+# 英數字詞 (407、rate_limit_exceeded、invalidparameterexception ...)
+_WORD = re.compile(r"[a-z0-9_]+")
+# 中日韓文字，切成 bigram
+_CJK = re.compile(r"[㐀-鿿豈-﫿]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    簡單的中英混合斷詞：
+    - 英數字以非英數字元切開 (小寫)
+    - 中文連續字串切成 bigram (只有一個字時保留單字)
+    """
+    text = (text or "").lower()
+    tokens = _WORD.findall(text)
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def card_search_text(card: ErrorCard) -> str:
+    """BM25 索引的內容：正文 + tags + id / error_code / http_status。"""
+    parts = [card.id, card.content, " ".join(map(str, card.tags or []))]
+    if card.error_code:
+        parts.append(str(card.error_code))
+    if card.http_status is not None:
+        parts.append(str(card.http_status))
+    return "\n".join(parts)
+
+
+class BM25Index:
+    """
+    行程內的 BM25 字詞索引。
+    卡片數量不多，純 Python 的倒排索引就能在微秒等級回答像 "407"、
+    "certificate verify failed" 這種關鍵字型查詢，完全不用呼叫 embedding。
+    """
+
+    def __init__(self, cards: Sequence[ErrorCard], k1: float = 1.5, b: float = 0.75) -> None:
+        self.cards: List[ErrorCard] = list(cards)
+        self.k1 = k1
+        self.b = b
+
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._doc_len: List[int] = []
+        for idx, card in enumerate(self.cards):
+            tf = Counter(tokenize(card_search_text(card)))
+            self._doc_len.append(sum(tf.values()))
+            for term, freq in tf.items():
+                self._postings[term].append((idx, freq))
+
+        n = len(self.cards)
+        self._avg_len = (sum(self._doc_len) / n) if n else 0.0
+        self._idf: Dict[str, float] = {
+            term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self._postings.items()
+        }
+        # 沒出現在語料裡的詞，視為和最罕見的詞一樣重要 (用來計算 coverage)
+        self._max_idf = max(self._idf.values()) if self._idf else 1.0
+
+    def idf(self, term: str) -> float:
+        return self._idf.get(term, 0.0)
+
+    def search(self, query: str, k: int = 5) -> Tuple[List[Tuple[ErrorCard, float]], float]:
+        """
+        回傳 ([(card, bm25_score), ...], coverage)。
+
+        coverage：最高分那張卡片涵蓋了多少比例的 query 詞 (以 idf 加權，0~1)。
+        query 裡越多詞不在卡片中 (例如一般對話、語意型問題)，coverage 越低，
+        呼叫端可以用它判斷字詞訊號夠不夠強、要不要再跑向量檢索。
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.cards:
+            return [], 0.0
+
+        scores: Dict[int, float] = defaultdict(float)
+        matched_terms: Dict[int, List[str]] = defaultdict(list)
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for idx, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[idx] / (self._avg_len or 1))
+                scores[idx] += idf * freq * (self.k1 + 1) / (freq + norm)
+                matched_terms[idx].append(term)
+
+        if not scores:
+            return [], 0.0
+
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+
+        total_weight = sum(self._idf.get(t, self._max_idf) for t in terms)
+        top_idx = ranked[0][0]
+        covered = sum(self._idf[t] for t in matched_terms[top_idx])
+        coverage = covered / total_weight if total_weight else 0.0
+
+        return [(self.cards[idx], score) for idx, score in ranked], coverage
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Reciprocal Rank Fusion：score(d) = Σ 1 / (k + rank)。
+    不需要把 BM25 分數和向量距離換算到同一個尺度，只看各自的排名。
+    """
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
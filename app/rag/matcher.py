@@ -0,0 +1,142 @@
+# app/rag/matcher.py
+import re
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+
+from .models import ErrorCard
+
+# patterns 以這個前綴開頭時視為 regex，例如 "re:HTTP\s*40[13]"
+REGEX_PREFIX = "re:"
+
+
+class PatternMatch:
+    """
+    單張卡片的命中結果。
+    - matched: 命中的 pattern 原文
+    - longest: 最長一段命中文字的長度 (越長代表越具體)
+    - literal_hits / regex_hits: 命中的關鍵字 / regex 數量
+    """
+
+    __slots__ = ("card", "matched", "longest", "literal_hits", "regex_hits")
+
+    def __init__(self, card: ErrorCard) -> None:
+        self.card = card
+        self.matched: List[str] = []
+        self.longest = 0
+        self.literal_hits = 0
+        self.regex_hits = 0
+
+    def add(self, pattern: str, span_len: int, is_regex: bool) -> None:
+        if pattern in self.matched:
+            self.longest = max(self.longest, span_len)
+            return
+        self.matched.append(pattern)
+        self.longest = max(self.longest, span_len)
+        if is_regex:
+            self.regex_hits += 1
+        else:
+            self.literal_hits += 1
+
+    @property
+    def rank_key(self) -> Tuple[int, int, int]:
+        # 排序依據：最長命中長度 > 命中 pattern 數 > 關鍵字 (比 regex 更明確)
+        return (self.longest, self.literal_hits + self.regex_hits, self.literal_hits)
+
+    def __repr__(self) -> str:
+        return f"PatternMatch({self.card.id}, longest={self.longest}, matched={self.matched})"
+
+
+class PatternMatcher:
+    """
+    把所有卡片的 patterns 編譯成一個 Aho-Corasick 自動機：
+    對 query 只掃一次就能找出所有關鍵字命中，時間與 query 長度成線性 (貼上幾 KB 的 log 也一樣)。
+    "re:" 開頭的 pattern 另外編譯成 regex (只在建立時編譯一次)。
+    """
+
+    def __init__(self, cards: Sequence[ErrorCard]) -> None:
+        self.cards: List[ErrorCard] = list(cards)
+        # trie：每個 state 的轉移表、failure link、輸出 (keyword index list)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        # keyword index -> (card index, pattern 原文, 長度)
+        self._keywords: List[Tuple[int, str, int]] = []
+        self._regexes: List[Tuple[int, str, "re.Pattern[str]"]] = []
+
+        for card_idx, card in enumerate(self.cards):
+            for raw in card.patterns or []:
+                if not raw:
+                    continue
+                raw = str(raw)
+                if raw.startswith(REGEX_PREFIX):
+                    try:
+                        compiled = re.compile(raw[len(REGEX_PREFIX):], re.IGNORECASE)
+                    except re.error as e:
+                        print(f"⚠️ 卡片 {card.id} 的 regex pattern 無效，略過 {raw!r}: {e}")
+                        continue
+                    self._regexes.append((card_idx, raw, compiled))
+                else:
+                    self._add_keyword(card_idx, raw)
+
+        self._build_failure_links()
+
+    def _add_keyword(self, card_idx: int, raw: str) -> None:
+        word = raw.lower()
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(len(self._keywords))
+        self._keywords.append((card_idx, raw, len(word)))
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def match(self, query: str) -> List[PatternMatch]:
+        """
+        回傳依具體程度排序好的命中結果 (最明確的在前面)。
+        """
+        if not query:
+            return []
+
+        results: Dict[int, PatternMatch] = {}
+
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in query.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for kw_idx in out[state]:
+                card_idx, raw, length = self._keywords[kw_idx]
+                hit = results.get(card_idx)
+                if hit is None:
+                    hit = results[card_idx] = PatternMatch(self.cards[card_idx])
+                hit.add(raw, length, is_regex=False)
+
+        for card_idx, raw, compiled in self._regexes:
+            m = compiled.search(query)
+            if not m:
+                continue
+            hit = results.get(card_idx)
+            if hit is None:
+                hit = results[card_idx] = PatternMatch(self.cards[card_idx])
+            hit.add(raw, len(m.group(0)), is_regex=True)
+
+        return sorted(results.values(), key=lambda h: h.rank_key, reverse=True)
@@ -1,6 +1,6 @@
 # app/rag/models.py
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, NamedTuple, Optional, Tuple
 
 
 class ErrorCard(BaseModel):
@@ -11,6 +11,34 @@ class ErrorCard(BaseModel):
     error_code: Optional[str] = None
     severity: Optional[str] = None
     tags: List[str] = []
-    patterns: List[str] = []        # 關鍵字 / regex（先當關鍵字用）
+    patterns: List[str] = []        # 關鍵字（不分大小寫）/ regex（以 "re:" 開頭，例如 "re:HTTP\s*40[13]"）
     path: Optional[str] = None      # 檔案路徑（方便 debug）
     content: str                    # Markdown 正文（給 LLM 當 context）
+
+
+class CardHit(NamedTuple):
+    """
+    檢索結果。score 的意義依 source 而定：
+    - "pattern": patterns 命中，固定 1.0
+    - "exact":   錯誤代碼 / HTTP 狀態碼精準對應到卡片，固定 1.0
+    - "lexical": 只用 BM25 就足夠，分數為 BM25 分數
+    - "hybrid":  BM25 + 向量的 reciprocal rank fusion 分數
+    """
+    card_id: str
+    content: str
+    score: float
+    source: str
+
+
+class BatchRetrieval(NamedTuple):
+    """
+    retrieve_cards_batch 的結果：
+    - hits:           和輸入逐行對齊的檢索結果 (空白行為 [])
+    - histogram:      [(card_id, 行數), ...]，每行只算第一名，由多到少
+    - unique_lines:   去重後實際處理的行數
+    - embedded_lines: 其中需要走向量檢索 (呼叫 embedding) 的行數
+    """
+    hits: List[List[CardHit]]
+    histogram: List[Tuple[str, int]]
+    unique_lines: int
+    embedded_lines: int
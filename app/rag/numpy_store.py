@@ -0,0 +1,164 @@
+# app/rag/numpy_store.py
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+VECTORS_FILE = "vectors.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorIndex:
+    """
+    精確 (brute-force) 的 cosine 向量索引：
+    - 向量存成正規化過的 float32 .npy，以 memory-map 方式載入 (不佔 Python heap、啟動幾乎零成本)
+    - id / metadata 另外存在 manifest.json
+    - 查詢只要一次矩陣-向量乘法，卡片數量在十萬以內比走 Chroma (SQLite + HNSW) 還快
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: Sequence[str], metadatas: Sequence[dict], model_id: str = "") -> None:
+        if len(ids) != vectors.shape[0]:
+            raise ValueError(f"ids ({len(ids)}) 與向量數量 ({vectors.shape[0]}) 不一致")
+        self.vectors = vectors
+        self.ids: List[str] = list(ids)
+        self.metadatas: List[dict] = list(metadatas)
+        self.model_id = model_id
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> "NumpyVectorIndex":
+        index_path = Path(index_dir)
+        manifest = json.loads((index_path / MANIFEST_FILE).read_text(encoding="utf-8"))
+        vectors = np.load(index_path / VECTORS_FILE, mmap_mode="r" if mmap else None)
+        return cls(vectors, manifest["ids"], manifest.get("metadatas") or [{}] * len(manifest["ids"]),
+                   manifest.get("model_id", ""))
+
+    def save(self, index_dir: str) -> None:
+        """先寫暫存檔再 os.replace，讀取端不會看到寫到一半的檔案。"""
+        index_path = Path(index_dir)
+        index_path.mkdir(parents=True, exist_ok=True)
+
+        tmp_vectors = index_path / (VECTORS_FILE + ".tmp")
+        with open(tmp_vectors, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        tmp_manifest = index_path / (MANIFEST_FILE + ".tmp")
+        tmp_manifest.write_text(
+            json.dumps(
+                {
+                    "model_id": self.model_id,
+                    "dim": int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+                    "count": len(self.ids),
+                    "ids": self.ids,
+                    "metadatas": self.metadatas,
+                },
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+        os.replace(tmp_vectors, index_path / VECTORS_FILE)
+        os.replace(tmp_manifest, index_path / MANIFEST_FILE)
+
+    def search(self, query_vector: Sequence[float], k: int = 3, where: Optional[Dict] = None) -> List[Tuple[str, float]]:
+        """
+        回傳 [(id, cosine_similarity), ...]，由高到低。
+        where 為簡單的 metadata 過濾：值為單一值時比對相等 (例如 {"component": "gateway"})，
+        值為 list / tuple / set 時比對是否包含在其中 (例如 {"parent_id": ["ERR-A", "ERR-B"]})。
+        """
+        if not self.ids or k <= 0:
+            return []
+
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        scores = self.vectors @ (q / norm)
+
+        if where:
+            mask = np.array(
+                [all(_where_match(m.get(key), value) for key, value in where.items()) for m in self.metadatas],
+                dtype=bool,
+            )
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(k, len(self.ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+def _where_match(actual, expected) -> bool:
+    if isinstance(expected, (list, tuple, set, frozenset)):
+        return actual in expected
+    return actual == expected
+
+
+def export_collection(collection, index_dir: str, model_id: str = "") -> NumpyVectorIndex:
+    """
+    把 Chroma collection 裡已經算好的 embedding 匯出成 NumPy 索引 (不會重新呼叫 embedding)。
+    """
+    data = collection.get(include=["embeddings", "metadatas"])
+    ids = list(data["ids"])
+    embeddings = data.get("embeddings")
+    if embeddings is None or len(ids) == 0:
+        vectors = np.zeros((0, 0), dtype=np.float32)
+    else:
+        vectors = normalize_rows(np.asarray(embeddings))
+
+    index = NumpyVectorIndex(vectors, ids, list(data.get("metadatas") or [{}] * len(ids)), model_id)
+    index.save(index_dir)
+    return index
+
+
+_index: Optional[NumpyVectorIndex] = None
+_index_mtime: Optional[int] = None
+_index_lock = threading.Lock()
+
+
+def _manifest_mtime(index_dir: str) -> Optional[int]:
+    try:
+        return (Path(index_dir) / MANIFEST_FILE).stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_numpy_index(index_dir: str) -> NumpyVectorIndex:
+    """
+    取得共用的 NumPy 索引；manifest 檔有更新 (重建過) 才重新 memory-map。
+    """
+    global _index, _index_mtime
+    mtime = _manifest_mtime(index_dir)
+    if _index is not None and mtime == _index_mtime:
+        return _index
+
+    with _index_lock:
+        if _index is None or mtime != _index_mtime:
+            _index = NumpyVectorIndex.load(index_dir)
+            _index_mtime = mtime
+    return _index
+
+
+def install_numpy_index(index: NumpyVectorIndex, index_dir: str) -> None:
+    """
+    直接使用外部載入的索引 (例如 memory-map 預建索引檔)，
+    直到 index_dir 底下的 manifest 之後被重建為止。
+    """
+    global _index, _index_mtime
+    with _index_lock:
+        _index = index
+        _index_mtime = _manifest_mtime(index_dir)
+
+
+def has_numpy_index(index_dir: str) -> bool:
+    return _index is not None or _manifest_mtime(index_dir) is not None
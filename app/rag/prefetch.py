@@ -0,0 +1,87 @@
+# app/rag/prefetch.py
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from app.config import settings
+from .lexical import tokenize
+from .retriever import retrieve_cards_local
+
+# 預先檢索用的小 thread pool (只跑不需要 embedding 的幾層，都是 ms 等級)
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="wuli-prefetch")
+
+# 目前這個請求的預先檢索結果；LangChain 執行同步工具時會複製 context，工具裡也讀得到
+_current: contextvars.ContextVar[Optional["CardPrefetch"]] = contextvars.ContextVar("card_prefetch", default=None)
+
+
+def format_card_results(hits: List[Tuple[str, str]]) -> str:
+    """search_error_cards 的輸出格式 (預先檢索注入 prompt 時也用同一種格式)。"""
+    if not hits:
+        return "搜尋維運手冊後，沒有發現直接相關的說明。"
+
+    context_blocks = []
+    for idx, (card_id, content) in enumerate(hits, start=1):
+        context_blocks.append(f"[Result {idx}: {card_id}]\n{content}")
+
+    return "\n\n".join(context_blocks)
+
+
+class CardPrefetch:
+    """
+    在第一次 LLM 呼叫的同時，先用使用者的原始輸入跑不需要 embedding 的檢索 (不會放進 prompt)。
+    patterns / 狀態碼 / BM25 都沒有把握時結果是 None，工具照常檢索。
+    模型接著呼叫 search_error_cards 且查的是同一件事時，已經跑完的結果就直接用。
+    """
+
+    def __init__(self, query: str, k: int = 3) -> None:
+        self.query = query
+        self.k = k
+        self._tokens = set(tokenize(query))
+        self.future: "Future[Optional[List[Tuple[str, str]]]]" = _executor.submit(retrieve_cards_local, query, k)
+
+    def result(self) -> Optional[List[Tuple[str, str]]]:
+        """還沒跑完、沒有把握 (需要向量檢索) 或檢索失敗都回傳 None；不會等待。"""
+        if not self.future.done():
+            return None
+        try:
+            return self.future.result()
+        except Exception as e:
+            print(f"⚠️ 預先檢索失敗: {e}")
+            return None
+
+    def covers(self, query: str) -> bool:
+        """
+        工具查詢的內容是否就是使用者原始輸入裡的東西
+        (模型通常只是把錯誤訊息摘出來或換個說法)。
+        """
+        tokens = set(tokenize(query))
+        if not tokens:
+            return False
+        return len(tokens & self._tokens) / len(tokens) >= settings.PREFETCH_MIN_OVERLAP
+
+
+def start_card_prefetch(query: str) -> Optional[CardPrefetch]:
+    """開始預先檢索，並設定成目前請求 (context) 的預先檢索結果。"""
+    query = (query or "").strip()
+    if not settings.PREFETCH_ENABLED or not query:
+        _current.set(None)
+        return None
+    prefetch = CardPrefetch(query)
+    _current.set(prefetch)
+    return prefetch
+
+
+def clear_card_prefetch() -> None:
+    _current.set(None)
+
+
+def prefetched_cards_for(query: str, k: int = 3) -> Optional[List[Tuple[str, str]]]:
+    """
+    search_error_cards 用：這次查詢能用預先檢索的結果就回傳，否則回傳 None (照常檢索)。
+    預先檢索還沒跑完就不等 (直接檢索一次不會比較慢)。
+    """
+    prefetch = _current.get()
+    if prefetch is None or prefetch.k < k or not prefetch.covers(query):
+        return None
+    hits = prefetch.result()
+    return hits[:k] if hits is not None else None
@@ -0,0 +1,109 @@
+# app/rag/query_cache.py
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+# 會因為每次貼上而不同、但和「是哪種錯誤」無關的片段
+# 順序有意義：先遮長的 (UUID / 時間戳)，再遮短的 (數字)
+_VOLATILE_PATTERNS = [
+    # 2025-12-17T17:20:00.123Z / 2025/12/17 17:20:00 / 2025-12-17
+    (re.compile(r"\b\d{4}[-/]\d{1,2}[-/]\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?)?\b"), "<ts>"),
+    # 17:20:00 / 17:20:00.123
+    (re.compile(r"\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?\b"), "<time>"),
+    # UUID
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<uuid>"),
+    # IPv4 (+port)
+    (re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}(?::\d{1,5})?\b"), "<ip>"),
+    # 常見的 request / trace id：chatcmpl-xxx、req_xxx、msg_xxx ...
+    (re.compile(r"\b(?:chatcmpl|req|msg|run|call|trace|span|resp)[-_][A-Za-z0-9_-]{6,}\b", re.IGNORECASE), "<id>"),
+    # 長的 hex 字串 (hash / trace id)
+    (re.compile(r"\b[0-9a-fA-F]{16,}\b"), "<hex>"),
+    # 5 位數以上的數字 (epoch、token 數、port...)；3 位數的 HTTP 狀態碼保留
+    (re.compile(r"\b\d{5,}\b"), "<num>"),
+]
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def mask_volatile_tokens(text: str) -> str:
+    """
+    把時間戳、UUID、IP、request id 等易變片段換成佔位符，
+    讓「同一種錯誤、不同次貼上」變成同一段文字。
+    """
+    for pattern, placeholder in _VOLATILE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def query_fingerprint(query: str) -> str:
+    """遮蔽易變片段 + 小寫 + 壓縮空白後取 hash。"""
+    normalized = _WHITESPACE.sub(" ", mask_volatile_tokens(query)).strip().lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    有上限的 LRU + TTL 快取。
+    每筆資料會綁定建立時的索引版本，版本不同就視為失效 (卡片 / 向量索引更新後自動作廢)。
+    同時記錄命中率與「命中時省下的原始查詢時間」。
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 600.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (version, expires_at, cost_seconds, value)
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Any = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key: Hashable, version: Any) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            if version != self._version:
+                # 索引版本換了，舊資料全部作廢
+                self._data.clear()
+                self._version = version
+
+            entry = self._data.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry[2]
+            return entry[3]
+
+    def put(self, key: Hashable, version: Any, value: Any, cost_seconds: float = 0.0) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if version != self._version:
+                self._data.clear()
+                self._version = version
+            self._data[key] = (version, time.monotonic() + self.ttl, cost_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
@@ -0,0 +1,178 @@
+# app/rag/query_parser.py
+import re
+from pathlib import Path
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .models import ErrorCard
+
+
+# 明確標示為狀態碼的寫法：HTTP 429 / HTTP/1.1 504 / status: 401 / "status_code": 500 / Error code: 429
+_STATUS_CONTEXT_RE = re.compile(
+    r"""(?:\bHTTP(?:/\d(?:\.\d)?)?\s*|\bstatus(?:[ _]?code)?["']?\s*[:=]?\s*|\berror[ _]?code["']?\s*[:=]?\s*|\bcode["']?\s*[:=]\s*)"""
+    r"""([1-5]\d{2})\b""",
+    re.IGNORECASE,
+)
+
+# 狀態碼後面接標準的 reason phrase：429 Too Many Requests / 504 Gateway Timeout
+_STATUS_REASON_RE = re.compile(
+    r"\b([45]\d{2})[\s:-]+(?:Too Many|Unauthorized|Forbidden|Not Found|Bad Request|Internal Server|Bad Gateway|"
+    r"Service Unavailable|Gateway Time-?out|Proxy Authentication|Request Time-?out|Payload Too Large|Unprocessable)",
+    re.IGNORECASE,
+)
+
+# provider 回傳的錯誤代碼：{"code": "rate_limit_exceeded"} / type=invalid_request_error / ThrottlingException
+_ERROR_CODE_FIELD_RE = re.compile(
+    r"""["']?\b(?:code|type|error_code|__type)["']?\s*[:=]\s*["']?([A-Za-z][A-Za-z0-9_.-]{2,})""",
+    re.IGNORECASE,
+)
+_EXCEPTION_NAME_RE = re.compile(r"\b([A-Z][A-Za-z]+(?:Exception|Error))\b")
+
+# 模型名稱 (給 check_model_eol / 路由判斷用，不參與過濾)
+_MODEL_RE = re.compile(
+    r"\b(?:gpt-[\w.-]+|o[134](?:-mini|-preview)?|(?:anthropic\.|us\.anthropic\.)?claude-[\w.:-]+|gemini-[\w.-]+|"
+    r"text-embedding-[\w-]+|(?:meta\.)?llama[\w.:-]*|mistral[\w.:-]*|amazon\.(?:titan|nova)[\w.:-]*|"
+    r"cohere\.[\w.:-]+)",
+    re.IGNORECASE,
+)
+
+# 元件關鍵字 -> 元件名稱；名稱會和卡片的 component 或所在目錄 (error_docs/<dir>/) 比對
+COMPONENT_HINTS: Dict[str, Tuple[str, ...]] = {
+    "gateway": ("gateway", "litellm", "proxy_server", "閘道"),
+    "guardrail": ("guardrail", "guardrails", "護欄", "keyword check", "content has been rejected"),
+    "cognito": ("cognito", "user pool", "id token", "id_token", "notauthorizedexception"),
+}
+_COMPONENT_RE = {
+    name: re.compile("|".join(re.escape(h) for h in hints), re.IGNORECASE)
+    for name, hints in COMPONENT_HINTS.items()
+}
+
+
+class QuerySignals(NamedTuple):
+    """從貼上的錯誤訊息抽出來的結構化線索。"""
+    http_statuses: Tuple[int, ...] = ()
+    error_codes: Tuple[str, ...] = ()
+    components: Tuple[str, ...] = ()
+    models: Tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.http_statuses or self.error_codes or self.components or self.models)
+
+
+def _unique(values) -> tuple:
+    return tuple(dict.fromkeys(values))
+
+
+def _card_component_names(card: ErrorCard) -> Set[str]:
+    names = {card.component.strip().lower()}
+    if card.path:
+        names.add(Path(card.path).parent.name.lower())
+    return names
+
+
+class QueryParser:
+    """
+    跟著 CardSnapshot 一起建立的前處理器：
+    - 全部都是預先編譯好的 regex，一次掃描，不需要 embedding
+    - 卡片上有的 error_code 另外編成一個 regex，可以直接在訊息裡找到
+    - candidates() 把線索轉成候選卡片 id，exact_match() 判斷能不能直接回傳某張卡
+    """
+
+    def __init__(self, cards: Sequence[ErrorCard]) -> None:
+        self._cards = tuple(cards)
+        self._by_status: Dict[int, List[ErrorCard]] = {}
+        self._by_code: Dict[str, List[ErrorCard]] = {}
+        self._by_component: Dict[str, List[ErrorCard]] = {}
+
+        for card in self._cards:
+            # 範本卡片用 http_status: 000 佔位，不參與精準比對
+            if card.http_status is not None and int(card.http_status) == 0:
+                continue
+            if card.http_status is not None:
+                self._by_status.setdefault(int(card.http_status), []).append(card)
+            if card.error_code:
+                self._by_code.setdefault(str(card.error_code).lower(), []).append(card)
+
+        for card in self._cards:
+            for name in _card_component_names(card):
+                self._by_component.setdefault(name, []).append(card)
+
+        codes = sorted(self._by_code, key=len, reverse=True)
+        self._known_code_re = (
+            re.compile(r"(?<![\w.-])(?:" + "|".join(re.escape(c) for c in codes) + r")(?![\w-])", re.IGNORECASE)
+            if codes else None
+        )
+
+    def parse(self, query: str) -> QuerySignals:
+        text = query or ""
+
+        statuses = [int(m.group(1)) for m in _STATUS_CONTEXT_RE.finditer(text)]
+        statuses += [int(m.group(1)) for m in _STATUS_REASON_RE.finditer(text)]
+
+        codes: List[str] = []
+        if self._known_code_re is not None:
+            codes += [m.group(0).lower() for m in self._known_code_re.finditer(text)]
+        codes += [m.group(1).lower() for m in _ERROR_CODE_FIELD_RE.finditer(text)]
+        codes += [m.group(1).lower() for m in _EXCEPTION_NAME_RE.finditer(text)]
+        # 純數字的 code 已經當成狀態碼處理了
+        codes = [c for c in codes if not c.isdigit()]
+
+        components = [name for name, regex in _COMPONENT_RE.items() if regex.search(text)]
+        models = [m.group(0) for m in _MODEL_RE.finditer(text)]
+
+        return QuerySignals(
+            http_statuses=_unique(statuses),
+            error_codes=_unique(codes),
+            components=_unique(components),
+            models=_unique(models),
+        )
+
+    def exact_match(self, signals: QuerySignals) -> List[ErrorCard]:
+        """
+        錯誤代碼完全相符、或狀態碼只對應到一張卡片時，直接回傳該卡片 (不需要檢索)。
+        兩種線索都有時必須一致。
+        """
+        code_cards = [c for code in signals.error_codes for c in self._by_code.get(code, [])]
+        if code_cards:
+            if signals.http_statuses:
+                agreed = [
+                    c for c in code_cards
+                    if c.http_status is None or int(c.http_status) in signals.http_statuses
+                ]
+                return list(_unique(agreed))
+            return list(_unique(code_cards))
+
+        if len(signals.http_statuses) == 1:
+            status_cards = self._by_status.get(signals.http_statuses[0], [])
+            status_cards = self._narrow_by_component(status_cards, signals.components)
+            if len(status_cards) == 1:
+                return status_cards
+        return []
+
+    def candidates(self, signals: QuerySignals) -> Optional[FrozenSet[str]]:
+        """
+        依狀態碼 / 元件縮小候選卡片範圍，回傳卡片 id 集合；沒有可用線索時回傳 None (不過濾)。
+        條件互相矛盾 (交集為空) 時依序放寬：先放掉元件，再放掉狀態碼。
+        """
+        status_ids = {
+            c.id for s in signals.http_statuses for c in self._by_status.get(s, [])
+        } if signals.http_statuses else None
+        component_ids = {
+            c.id for name in signals.components for c in self._by_component.get(name, [])
+        } if signals.components else None
+
+        if status_ids and component_ids:
+            both = status_ids & component_ids
+            if both:
+                return frozenset(both)
+        if status_ids:
+            return frozenset(status_ids)
+        if component_ids:
+            return frozenset(component_ids)
+        return None
+
+    def _narrow_by_component(self, cards: List[ErrorCard], components: Tuple[str, ...]) -> List[ErrorCard]:
+        if not components or len(cards) <= 1:
+            return cards
+        wanted = set(components)
+        narrowed = [c for c in cards if _card_component_names(c) & wanted]
+        return narrowed or cards
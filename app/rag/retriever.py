@@ -1,76 +1,538 @@
 # app/rag/retriever.py
-from typing import List, Tuple
+from pathlib import Path
+from collections import Counter
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
 import re
+import threading
+import time
 
-from .models import ErrorCard
-from .error_card_loader import load_error_cards
-from .chroma_store import index_error_cards, get_collection
+import numpy as np
+
+from app.config import settings
+from .models import BatchRetrieval, CardHit, ErrorCard
+from .card_store import CardStore
+from .matcher import PatternMatch
+from .query_parser import QuerySignals
+from .query_cache import QueryCache, query_fingerprint
+from .lexical import reciprocal_rank_fusion, tokenize
+from .chroma_store import (
+    current_content_hashes,
+    get_collection,
+    get_embedding_function,
+    index_error_cards,
+    index_pointer_version,
+    install_index_version,
+    rollback_index,
+)
+from .numpy_store import (
+    NumpyVectorIndex,
+    export_collection,
+    get_numpy_index,
+    has_numpy_index,
+    install_numpy_index,
+    normalize_rows,
+)
+from .artifact import export_index_artifact, open_index_artifact
+from .chunking import CardSection, parent_id_of, section_embedding_text, split_card_sections
 
 # error_docs 目錄 & collection 名稱
 ERROR_DOCS_DIR = "./error_docs"
 COLLECTION_NAME = "error_cards"
 
+# 混合檢索時，BM25 / 向量各取幾個候選再做 rank fusion
+FUSION_CANDIDATES = 10
+
+# 有段落沒放進去時附在最後的提示 (放得下才加)
+OMITTED_NOTE = "\n\n(…其餘段落已省略)"
+
+# 避免啟動流程與背景 watcher 同時重建索引
+_index_lock = threading.Lock()
+
+# 行程內共用的卡片快取 (只重新解析有變動的檔案)
+_card_store = CardStore(ERROR_DOCS_DIR)
+
+
+# 向量索引每次有實際變動就 +1，和卡片庫版本一起決定查詢快取是否失效
+_vector_index_version = 0
+
+# retrieve_cards 前面的查詢快取
+_query_cache = QueryCache(maxsize=settings.QUERY_CACHE_SIZE, ttl=settings.QUERY_CACHE_TTL)
+
+
+def get_card_store() -> CardStore:
+    return _card_store
+
+
+def current_index_version() -> Tuple[int, int, object]:
+    """
+    (卡片庫版本, 向量索引版本, 版本指標檔 mtime)，任何一個變了，查詢快取就全部作廢。
+    指標檔 mtime 讓其他行程 (例如 scripts/rebuild_index.py) 切換版本時也能被察覺。
+    """
+    return (_card_store.snapshot().version, _vector_index_version, index_pointer_version(COLLECTION_NAME))
+
+
+def query_cache_stats() -> dict:
+    return _query_cache.stats()
+
 
 def init_rag():
     """
     啟動或重建索引用：
     1. 從 ERROR_DOCS_DIR 載入所有 Error Card
-    2. 重建 Chroma collection（覆蓋舊的）
+    2. 增量同步 Chroma collection（只 embedding 新增 / 變動的卡片）
+
+    回傳 (cards, collection, stats)
+    """
+    global _vector_index_version
+    with _index_lock:
+        cards = _card_store.get_cards(force_refresh=True)
+        collection, stats = index_error_cards(cards, COLLECTION_NAME)
+        changed = stats["added"] or stats["updated"] or stats["removed"]
+        if settings.VECTOR_BACKEND == "numpy" and (changed or not has_numpy_index(settings.NUMPY_INDEX_DIR)):
+            # 從 Chroma 匯出已算好的向量，不會重新呼叫 embedding
+            export_collection(collection, settings.NUMPY_INDEX_DIR, get_embedding_function().model_id)
+        if changed:
+            _vector_index_version += 1
+    return cards, collection, stats
+
+
+def export_rag_artifact(path: str) -> dict:
+    """把目前的索引 (同步到最新後) 匯出成可攜式索引檔。"""
+    cards, collection, _ = init_rag()
+    return export_index_artifact(path, collection, cards, get_embedding_function().model_id)
+
+
+def load_index_artifact(path: str) -> bool:
+    """
+    載入預建索引檔：
+    1. embedding 模型不一致 → 放棄 (向量不能混用)
+    2. 把 (卡片內容, 向量) 寫進 embedding 快取，之後的增量同步不會再呼叫 provider
+    3. 目前的 Chroma 版本與索引檔內容不同 → 直接用索引檔的向量建立新版本並切換
+    4. NumPy 後端 → 正規化後存成 NumPy 索引並 memory-map (索引檔裡是原始向量)
+    索引檔裡找不到對應段落的 id (切段規則改過) 直接略過，之後的增量同步會補上。
+    回傳是否有載入。
+    """
+    global _vector_index_version
+    started = time.perf_counter()
+    artifact = open_index_artifact(path)
+    emb_fn = get_embedding_function()
+    if artifact.model_id != emb_fn.model_id:
+        print(f"⚠️ 預建索引檔的模型 {artifact.model_id} 與目前設定 {emb_fn.model_id} 不同，略過")
+        return False
+
+    # 由索引檔裡的卡片重新切段，還原每個 chunk 的內容與拿去 embedding 的文字
+    sections = {}
+    for card in artifact.cards:
+        for section in split_card_sections(card):
+            sections[section.chunk_id] = (section.text, section_embedding_text(card, section))
+
+    ids, vectors, metadatas = artifact.ids, artifact.vectors, artifact.metadatas
+    keep = [n for n, i in enumerate(ids) if i in sections]
+    if len(keep) < len(ids):
+        print(f"⚠️ 預建索引檔有 {len(ids) - len(keep)} 筆找不到對應的段落，略過")
+        ids = [ids[n] for n in keep]
+        metadatas = [metadatas[n] for n in keep]
+        vectors = np.asarray(vectors)[keep]
+
+    documents = [sections[i][0] for i in ids]
+    emb_fn.seed_cache([sections[i][1] for i in ids], vectors)
+    content_hashes = {i: (m or {}).get("content_hash", "") for i, m in zip(ids, metadatas)}
+
+    with _index_lock:
+        if current_content_hashes(COLLECTION_NAME) != content_hashes:
+            install_index_version(COLLECTION_NAME, ids, vectors, documents, metadatas)
+            _vector_index_version += 1
+        if settings.VECTOR_BACKEND == "numpy":
+            NumpyVectorIndex(normalize_rows(vectors), ids, metadatas, artifact.model_id).save(settings.NUMPY_INDEX_DIR)
+            install_numpy_index(NumpyVectorIndex.load(settings.NUMPY_INDEX_DIR), settings.NUMPY_INDEX_DIR)
+
+    print(f"📦 已載入預建索引檔 {path} ({len(ids)} 筆, {time.perf_counter() - started:.2f}s)")
+    return True
+
+
+def rollback_rag_index():
+    """
+    把向量索引切回上一個版本 (瞬間完成，不重新 embedding)。回傳切換後的版本名稱或 None。
+    """
+    global _vector_index_version
+    with _index_lock:
+        version_name = rollback_index(COLLECTION_NAME)
+        if version_name is None:
+            return None
+        if settings.VECTOR_BACKEND == "numpy":
+            export_collection(get_collection(COLLECTION_NAME), settings.NUMPY_INDEX_DIR,
+                              get_embedding_function().model_id)
+        _vector_index_version += 1
+    return version_name
+
+
+def ensure_rag_index():
     """
-    cards = load_error_cards(ERROR_DOCS_DIR)
-    collection = index_error_cards(cards, COLLECTION_NAME)
-    return cards, collection
+    服務啟動時呼叫一次，把索引同步到 error_docs/ 目前的狀態：
+    - collection 已存在且卡片沒變 → 只比對 content_hash，不做任何 embedding
+    - 停機期間有卡片變動 → 只重算那幾張
+    - 不存在或是空的 → 完整建立
+    - 有設定 INDEX_ARTIFACT_PATH → 先載入預建索引檔 (不呼叫 embedding provider)，
+      之後的同步只會處理索引檔建立後才變動的卡片
+
+    之後的變動交給 app.rag.watcher 處理，請求路徑上不會再重建索引。
+    """
+    artifact_path = settings.INDEX_ARTIFACT_PATH
+    if artifact_path and Path(artifact_path).exists():
+        try:
+            load_index_artifact(artifact_path)
+        except Exception as e:
+            print(f"⚠️ 載入預建索引檔失敗，改為一般建立流程: {e}")
+
+    _, collection, stats = init_rag()
+    print(f"📚 索引 '{COLLECTION_NAME}' 已就緒 {format_index_stats(stats)}")
+    return collection
+
+
+def format_index_stats(stats: dict) -> str:
+    return (
+        f"(added={stats['added']}, updated={stats['updated']}, "
+        f"removed={stats['removed']}, unchanged={stats['unchanged']})"
+    )
 
 
 def rule_based_match(query: str, k: int = 3) -> List[ErrorCard]:
     """
     第一層：使用 ErrorCard.patterns 做 rule-based 匹配。
-    只要 patterns 中任一字串出現在 query 內，就視為命中。
+    patterns 中任一關鍵字出現在 query 內 (或 "re:" regex 命中)，就視為命中。
+    結果依命中的具體程度排序 (命中文字越長、命中越多 pattern 越前面)。
 
-    每次都從 error_docs/ 重新載入，
-    這樣新增 / 修改卡片不需要重啟服務就會生效。
+    卡片來自記憶體中的 CardStore，它會定期 stat error_docs/ 並只重新解析有變動的檔案，
+    這樣新增 / 修改卡片不需要重啟服務就會生效，也不用每次查詢都重讀所有檔案。
     """
-    cards = load_error_cards(ERROR_DOCS_DIR)
+    return [m.card for m in match_patterns(query)[:k]]
 
-    hits: List[ErrorCard] = []
-    q = query.lower()
 
-    for card in cards:
-        if not card.patterns:
-            continue
-        for p in card.patterns:
-            if not p:
-                continue
-            if p.lower() in q:
-                hits.append(card)
-                break  # 一張卡片只算一次命中
+def match_patterns(query: str) -> List[PatternMatch]:
+    """
+    回傳完整的 pattern 命中結果 (含排序分數)，給需要判斷信心程度的呼叫端使用。
+    """
+    snapshot = _card_store.snapshot()
+    return snapshot.matcher.match(query)
+
+def parse_query(query: str) -> QuerySignals:
+    """
+    從錯誤訊息抽出 HTTP 狀態碼、錯誤代碼、元件與模型名稱 (純 regex，不需要 embedding)。
+    """
+    return _card_store.snapshot().parser.parse(query)
 
-    return hits[:k]
 
 def retrieve_cards(query: str, k: int = 3) -> List[Tuple[str, str]]:
     """
-    對外的檢索介面：
+    對外的檢索介面，回傳 [(card_id, card_content), ...]。
+    需要分數時請用 retrieve_cards_with_scores()。
+    """
+    return [(h.card_id, h.content) for h in retrieve_cards_with_scores(query, k=k)]
+
+
+def retrieve_cards_with_scores(query: str, k: int = 3) -> List[CardHit]:
+    """
+    檢索流程：
 
     1. 先用 rule-based pattern match（patterns）
-    2. 若沒有命中，再看這句話是不是「錯誤 / log 型」
-       - 是：才 fallback 到 Chroma 語意搜尋
-       - 否：直接不啟用 RAG（回傳空），交給 LLM 用對話上下文回答
-    3. 回傳 [(card_id, card_content), ...]
+    2. 沒命中 → regex 抽出狀態碼 / 錯誤代碼 / 元件；錯誤代碼相符或狀態碼只對應一張卡就直接回傳，
+       否則用這些線索縮小候選卡片範圍 (Chroma where 過濾)
+    3. 行程內 BM25 字詞檢索；字詞訊號夠強 (coverage 高) 就直接回傳，不呼叫 embedding
+    4. 字詞訊號弱 → 才跑 Chroma 語意搜尋 (段落層級)，和 BM25 結果做 reciprocal rank fusion
+    5. 每張卡片只保留最相關的段落，總長度不超過 RAG_CONTEXT_CHAR_BUDGET
+    6. 回傳 [CardHit(card_id, content, score, source), ...]
+
+    前面有一層查詢快取：同一個錯誤換了時間戳 / request id / IP 再貼一次，
+    會直接拿到上次的結果，不用再 embedding + 查 Chroma。
     """
     query = (query or "").strip()
     if not query:
         return []
 
+    key = (query_fingerprint(query), k)
+    version = current_index_version()
+    cached = _query_cache.get(key, version)
+    if cached is not None:
+        return list(cached)
+
+    started = time.perf_counter()
+    hits = _retrieve_cards_uncached(query, k)
+    _query_cache.put(key, version, tuple(hits), time.perf_counter() - started)
+    return hits
+
+
+def retrieve_cards_local(query: str, k: int = 3) -> Optional[List[Tuple[str, str]]]:
+    """
+    只跑不需要 embedding 的幾層 (patterns / 狀態碼與錯誤代碼 / 強 BM25)。
+    有結果就回傳 (和 retrieve_cards 的結果相同)，需要向量檢索才找得到的回傳 None。
+    """
+    query = (query or "").strip()
+    if not query:
+        return None
+
+    key = (query_fingerprint(query), k)
+    version = current_index_version()
+    cached = _query_cache.get(key, version)
+    if cached is not None:
+        return [(h.card_id, h.content) for h in cached]
+
+    started = time.perf_counter()
+    plan = _plan_retrieval(_card_store.snapshot(), query, k)
+    if plan.hits is None:
+        return None
+    _query_cache.put(key, version, tuple(plan.hits), time.perf_counter() - started)
+    return [(h.card_id, h.content) for h in plan.hits]
+
+
+def _retrieve_cards_uncached(query: str, k: int) -> List[CardHit]:
+    snapshot = _card_store.snapshot()
+    plan = _plan_retrieval(snapshot, query, k)
+    if plan.hits is not None:
+        return plan.hits
+
+    chunk_ids = _vector_search(query, FUSION_CANDIDATES * 3, plan.allowed)
+    return _fuse_vector_hits(snapshot, plan, chunk_ids, k)
+
+
+class _RetrievalPlan(NamedTuple):
+    """
+    不需要 embedding 的前幾層跑完之後的結果：
+    hits 不是 None 代表已經有答案；否則要帶著 allowed / lexical 去做向量檢索。
+    """
+    query: str
+    hits: Optional[List[CardHit]]
+    allowed: Optional[FrozenSet[str]]
+    lexical: List[Tuple[ErrorCard, float]]
+
+
+def _plan_retrieval(snapshot, query: str, k: int) -> _RetrievalPlan:
     # --- 第一層：rule-based patterns ---
-    rb_hits = rule_based_match(query, k=k)
+    rb_hits = snapshot.matcher.match(query)[:k]
     if rb_hits:
-        return [(c.id, c.content) for c in rb_hits]
+        ranked = [(m.card.id, 1.0, "pattern") for m in rb_hits]
+        return _RetrievalPlan(query, _build_hits(snapshot, query, ranked, {}), None, [])
+
+    # --- 第二層：狀態碼 / 錯誤代碼 / 元件前處理 (compiled regex，不需要 embedding) ---
+    signals = snapshot.parser.parse(query)
+    exact = snapshot.parser.exact_match(signals)[:k]
+    if exact:
+        ranked = [(c.id, 1.0, "exact") for c in exact]
+        return _RetrievalPlan(query, _build_hits(snapshot, query, ranked, {}), None, [])
+    # 有線索時只在候選卡片裡找 (None 代表不過濾)
+    allowed = snapshot.parser.candidates(signals)
+
+    # --- 第三層：BM25 字詞檢索 (行程內，不需要網路) ---
+    lexical, coverage = snapshot.lexical.search(
+        query, k=len(snapshot.cards) if allowed is not None else FUSION_CANDIDATES,
+    )
+    top_allowed = bool(lexical) and (allowed is None or lexical[0][0].id in allowed)
+    if allowed is not None:
+        lexical = [(c, score) for c, score in lexical if c.id in allowed][:FUSION_CANDIDATES]
+    if top_allowed and coverage >= settings.LEXICAL_STRONG_COVERAGE:
+        ranked = [(c.id, round(score, 4), "lexical") for c, score in lexical[:k]]
+        return _RetrievalPlan(query, _build_hits(snapshot, query, ranked, {}), allowed, lexical)
+
+    return _RetrievalPlan(query, None, allowed, lexical)
+
+
+def _fuse_vector_hits(snapshot, plan: _RetrievalPlan, chunk_ids: List[str], k: int) -> List[CardHit]:
+    # --- 第四層：向量檢索 (段落層級，套用候選卡片過濾)，與 BM25 結果做 rank fusion ---
+    # chunk_id -> 向量檢索名次，用來挑段落
+    chunk_ranks: Dict[str, int] = {}
+    vector_card_ids: List[str] = []
+    for rank, chunk_id in enumerate(chunk_ids):
+        chunk_ranks.setdefault(chunk_id, rank)
+        parent = parent_id_of(chunk_id)
+        if parent not in vector_card_ids:
+            vector_card_ids.append(parent)
+
+    fused = reciprocal_rank_fusion([[c.id for c, _ in plan.lexical], vector_card_ids[:FUSION_CANDIDATES]])
+    ranked = [(card_id, round(score, 6), "hybrid") for card_id, score in fused if card_id in snapshot.by_id][:k]
+    return _build_hits(snapshot, plan.query, ranked, chunk_ranks)
+
+
+def retrieve_cards_batch(queries: Sequence[str], k: int = 3) -> BatchRetrieval:
+    """
+    一次檢索很多行 (例如上傳的 .log)：
+
+    1. 同樣的行 (遮掉時間戳 / request id 之後相同) 只處理一次
+    2. pattern / 狀態碼 / BM25 這幾層在行程內逐行跑完 (不需要網路)
+    3. 剩下的行合併成一次 embedding 呼叫，再用多筆 query_embeddings 一次查 Chroma
+       (同一組候選卡片過濾條件的行放在同一次查詢)
+    4. 回傳逐行結果 + 每張卡片是多少行的第一名 (histogram)
+    """
+    lines = [(q or "").strip() for q in queries]
+    snapshot = _card_store.snapshot()
+    version = current_index_version()
+
+    # fingerprint -> 代表這一組的那一行
+    unique: Dict[Tuple[str, int], str] = {}
+    for line in lines:
+        if line:
+            unique.setdefault((query_fingerprint(line), k), line)
+
+    results: Dict[Tuple[str, int], List[CardHit]] = {}
+    pending: List[Tuple[Tuple[str, int], _RetrievalPlan]] = []
+    for key, line in unique.items():
+        cached = _query_cache.get(key, version)
+        if cached is not None:
+            results[key] = list(cached)
+            continue
+        plan = _plan_retrieval(snapshot, line, k)
+        if plan.hits is not None:
+            results[key] = plan.hits
+            _query_cache.put(key, version, tuple(plan.hits), 0.0)
+        else:
+            pending.append((key, plan))
+
+    if pending:
+        started = time.perf_counter()
+        chunk_lists = _vector_search_batch(
+            [plan.query for _, plan in pending],
+            FUSION_CANDIDATES * 3,
+            [plan.allowed for _, plan in pending],
+        )
+        elapsed = (time.perf_counter() - started) / len(pending)
+        for (key, plan), chunk_ids in zip(pending, chunk_lists):
+            hits = _fuse_vector_hits(snapshot, plan, chunk_ids, k)
+            results[key] = hits
+            _query_cache.put(key, version, tuple(hits), elapsed)
+
+    per_line: List[List[CardHit]] = []
+    histogram: Counter = Counter()
+    for line in lines:
+        hits = results.get((query_fingerprint(line), k), []) if line else []
+        per_line.append(list(hits))
+        if hits:
+            histogram[hits[0].card_id] += 1
+
+    return BatchRetrieval(
+        hits=per_line,
+        histogram=histogram.most_common(),
+        unique_lines=len(unique),
+        embedded_lines=len(pending),
+    )
+
+
+def _build_hits(snapshot, query: str, ranked: List[Tuple[str, float, str]], chunk_ranks: Dict[str, int]) -> List[CardHit]:
+    """
+    每張卡片只挑出和 query 最相關的段落，總長度控制在 RAG_CONTEXT_CHAR_BUDGET 以內。
+    """
+    hits: List[CardHit] = []
+    # RAG_CONTEXT_CHAR_BUDGET <= 0 代表不裁切
+    trim = settings.RAG_CONTEXT_CHAR_BUDGET > 0
+    remaining = settings.RAG_CONTEXT_CHAR_BUDGET
+    query_terms = set(tokenize(query))
+
+    for idx, (card_id, score, source) in enumerate(ranked):
+        card = snapshot.by_id.get(card_id)
+        if card is None:
+            continue
+        if not trim:
+            hits.append(CardHit(card_id, card.content, score, source))
+            continue
+        if remaining <= 0:
+            # 額度用完了，後面名次較低的卡片不再放
+            break
+        budget = remaining // (len(ranked) - idx)
+        sections = snapshot.sections.get(card_id)
+        if sections:
+            content = select_sections(sections, query_terms, budget, chunk_ranks, snapshot.lexical.idf)
+        else:
+            content = card.content[:budget]
+        remaining -= len(content)
+        hits.append(CardHit(card_id, content, score, source))
+    return hits
+
+
+def select_sections(
+    sections: List[CardSection],
+    query_terms: set,
+    budget: int,
+    chunk_ranks: Dict[str, int],
+    idf,
+) -> str:
+    """
+    挑段落：
+    1. 和 query 重疊的字詞越多 (idf 加權)、向量檢索名次越前面的段落優先
+    2. 其餘段落依原本順序補上 (例如「建議：」通常緊接在命中的「通常代表：」後面)
+    3. 超過 budget 的段落不放；至少會放最相關的一段 (必要時截斷到 budget)
+    輸出時維持段落在卡片中的原始順序，總長度不超過 budget。
+    """
+    if not sections:
+        return ""
+
+    def relevance(section: CardSection) -> float:
+        overlap = sum(idf(t) for t in query_terms & set(tokenize(section.text)))
+        rank = chunk_ranks.get(section.chunk_id)
+        vector_bonus = (10.0 / (1 + rank)) if rank is not None else 0.0
+        return overlap + vector_bonus
+
+    scored = [(relevance(s), s) for s in sections]
+    order = [s for r, s in sorted(scored, key=lambda x: (-x[0], x[1].index)) if r > 0]
+    order += [s for r, s in scored if r <= 0]
+
+    chosen: List[CardSection] = []
+    used = 0
+    for section in order:
+        cost = len(section.text) + 2
+        if used + cost <= budget:
+            chosen.append(section)
+            used += cost
+
+    if not chosen:
+        return order[0].text[:budget]
+
+    chosen.sort(key=lambda s: s.index)
+    text = "\n\n".join(s.text for s in chosen)
+    if len(chosen) < len(sections) and len(text) + len(OMITTED_NOTE) <= budget:
+        text += OMITTED_NOTE
+    return text
+
+
+def _vector_search(query: str, n_results: int, allowed=None) -> List[str]:
+    """回傳依相似度排序的 chunk id；allowed 為候選卡片 id (metadata parent_id 過濾)。"""
+    if settings.VECTOR_BACKEND == "numpy":
+        return _numpy_vector_search(query, n_results, allowed)
+
+    collection = get_collection(COLLECTION_NAME)
+
+    where = {"parent_id": {"$in": sorted(allowed)}} if allowed else None
+    res = collection.query(query_texts=[query], n_results=n_results, where=where, include=[])
+    return list(res.get("ids", [[]])[0])
+
+
+def _vector_search_batch(queries: List[str], n_results: int, alloweds: List) -> List[List[str]]:
+    """批次版 _vector_search：所有 query 一次 embedding，相同過濾條件的 query 共用一次 Chroma 查詢。"""
+    vectors = get_embedding_function()(queries)
+
+    if settings.VECTOR_BACKEND == "numpy":
+        index = get_numpy_index(settings.NUMPY_INDEX_DIR)
+        return [
+            [chunk_id for chunk_id, _ in index.search(vec, k=n_results, where={"parent_id": allowed} if allowed else None)]
+            for vec, allowed in zip(vectors, alloweds)
+        ]
 
-    # --- 第二層：fallback 到 embedding 檢索 ---
     collection = get_collection(COLLECTION_NAME)
 
-    res = collection.query(query_texts=[query], n_results=k)
-    ids = res.get("ids", [[]])[0]
-    docs = res.get("documents", [[]])[0]
+    groups: Dict[Optional[FrozenSet[str]], List[int]] = {}
+    for i, allowed in enumerate(alloweds):
+        groups.setdefault(allowed or None, []).append(i)
+
+    out: List[List[str]] = [[] for _ in queries]
+    for allowed, idxs in groups.items():
+        where = {"parent_id": {"$in": sorted(allowed)}} if allowed else None
+        res = collection.query(
+            query_embeddings=[vectors[i] for i in idxs], n_results=n_results, where=where, include=[],
+        )
+        for i, ids in zip(idxs, res.get("ids", [])):
+            out[i] = list(ids)
+    return out
+
 
-    return list(zip(ids, docs))
+def _numpy_vector_search(query: str, n_results: int, allowed=None) -> List[str]:
+    """NumPy 後端：embedding (走快取) + 一次矩陣-向量乘法。"""
+    index = get_numpy_index(settings.NUMPY_INDEX_DIR)
+    query_vector = get_embedding_function().embed_query([query])[0]
+    where = {"parent_id": allowed} if allowed else None
+    return [chunk_id for chunk_id, _ in index.search(query_vector, k=n_results, where=where)]
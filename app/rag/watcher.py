@@ -0,0 +1,99 @@
+# app/rag/watcher.py
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from app.config import settings
+from .retriever import ERROR_DOCS_DIR, init_rag, format_index_stats
+
+
+def snapshot_error_docs(root_dir: str = ERROR_DOCS_DIR) -> Dict[str, Tuple[int, int]]:
+    """
+    取得 error_docs/ 底下所有 .md 的 {path: (mtime_ns, size)}。
+    只做 stat，不讀檔，所以很便宜。
+    """
+    root_path = Path(root_dir)
+    if not root_path.exists():
+        return {}
+
+    snapshot = {}
+    for path in root_path.rglob("*.md"):
+        try:
+            st = path.stat()
+        except OSError:
+            continue  # 檔案在掃描途中被刪掉
+        snapshot[str(path)] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+
+class ErrorDocsWatcher:
+    """
+    背景輪詢 error_docs/，只有在檔案新增 / 修改 / 刪除時才重建索引。
+    新卡片不用重啟服務就會生效，而且不會讓任何請求付出重建成本。
+    """
+
+    def __init__(self, root_dir: str = ERROR_DOCS_DIR, interval: float = 10.0) -> None:
+        self.root_dir = root_dir
+        self.interval = interval
+        self._snapshot = snapshot_error_docs(root_dir)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check_once(self) -> bool:
+        """比對一次快照，有變動就重建索引；回傳是否有重建。"""
+        current = snapshot_error_docs(self.root_dir)
+        if current == self._snapshot:
+            return False
+
+        changed = set(current) ^ set(self._snapshot)
+        changed |= {p for p in current if p in self._snapshot and current[p] != self._snapshot[p]}
+        print(f"📝 偵測到 error_docs 變動 ({len(changed)} 個檔案)，重建索引中...")
+
+        try:
+            cards, _, stats = init_rag()
+        except Exception as e:
+            # 失敗時不更新快照，下一輪會再試一次
+            print(f"❌ 索引重建失敗: {e}")
+            return False
+
+        self._snapshot = current
+        print(f"✅ 索引已更新，共 {len(cards)} 張卡片 {format_index_stats(stats)}")
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"❌ error_docs watcher 發生錯誤: {e}")
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="error-docs-watcher", daemon=True)
+        self._thread.start()
+        print(f"👀 開始監看 {self.root_dir} (每 {self.interval:g} 秒檢查一次)")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_watcher: Optional[ErrorDocsWatcher] = None
+
+
+def start_error_docs_watcher(interval: Optional[float] = None) -> Optional[ErrorDocsWatcher]:
+    """
+    啟動 (單一) 背景 watcher。interval <= 0 代表停用。
+    """
+    global _watcher
+    if interval is None:
+        interval = settings.ERROR_DOCS_WATCH_INTERVAL
+    if interval <= 0:
+        print("⏸️  error_docs watcher 已停用 (ERROR_DOCS_WATCH_INTERVAL <= 0)")
+        return None
+
+    if _watcher is None:
+        _watcher = ErrorDocsWatcher(interval=interval)
+    _watcher.start()
+    return _watcher
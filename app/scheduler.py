@@ -10,7 +10,7 @@ from apscheduler.triggers.cron import CronTrigger
 from langchain_core.messages import HumanMessage
 
 # 引入 LLM Factory 來做摘要/查詢
-from app.llm_factory import build_agent_executor
+from app.llm_factory import get_agent_executor
 # 引入 log 路徑
 from app.tools.incident import LOG_FILE, _save_logs
 from app.config import settings
@@ -147,7 +147,7 @@ def run_weekly_eol_scan():
     expiring_models = set()
     
     # 這裡只需要 Admin 權限來執行 Tavily 搜尋，不需要寄信權限 (因為我們改用 Python 寄信了)
-    agent = build_agent_executor(is_admin=True) 
+    agent = get_agent_executor(is_admin=True)
     
     print(f"🔍 正在查詢 {len(unique_models)} 個模型的 EOL 資訊...")
     
@@ -0,0 +1,177 @@
+# app/tools/cache.py
+import datetime
+import inspect
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from app.config import settings
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 工具回傳這些開頭的字串代表失敗 (連線錯誤、參數錯誤...)，不快取，下次重新呼叫
+ERROR_PREFIXES = ("💥", "❌", "⛔")
+
+
+class ToolResultCache:
+    """
+    單一工具的結果快取：TTL 到期就失效，超過 maxsize 筆時丟掉最久沒用的 (LRU)。
+    """
+
+    def __init__(self, ttl: float, maxsize: int) -> None:
+        self.ttl = ttl
+        self.maxsize = max(1, maxsize)
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Any:
+        """回傳快取的結果；沒有 (或過期) 時回傳 None。"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+# 工具名稱 -> 快取 (給 tool_cache_stats 用；admin / user 兩個 Agent 共用同一份)
+_caches: Dict[str, ToolResultCache] = {}
+_caches_lock = threading.Lock()
+
+
+def _normalize(value: Any, casefold: bool) -> Any:
+    if isinstance(value, str):
+        value = _WHITESPACE_RE.sub(" ", value).strip()
+        return value.casefold() if casefold else value
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v, casefold) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v, casefold)) for k, v in value.items()))
+    return value
+
+
+def is_ok_text(result: Any) -> bool:
+    """工具回傳的是正常的文字結果 (不是 💥 / ❌ / ⛔ 開頭的錯誤訊息)。"""
+    return isinstance(result, str) and bool(result.strip()) and not result.lstrip().startswith(ERROR_PREFIXES)
+
+
+def has_search_results(result: Any) -> bool:
+    """Tavily 回傳的原始結果 (dict) 有搜尋結果、且沒有錯誤。"""
+    return isinstance(result, dict) and not result.get("error") and bool(result.get("results"))
+
+
+def cached_tool(
+    tool: BaseTool,
+    ttl: float,
+    maxsize: Optional[int] = None,
+    casefold_args: Iterable[str] = (),
+    cacheable_args: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    cacheable_result: Callable[[Any], bool] = is_ok_text,
+) -> BaseTool:
+    """
+    包裝一個「純讀取」的 LangChain 工具，相同參數在 ttl 秒內直接回傳上次的結果。
+
+    - 參數正規化：補上預設值、字串去頭尾空白 / 合併連續空白，casefold_args 裡的參數不分大小寫
+    - cacheable_args(args) 回傳 False 的呼叫不快取 (例如查「最近 N 分鐘」的 log)
+    - cacheable_result(result) 回傳 False 的結果不快取 (失敗 / 空結果)；預設只收正常的文字結果
+    - 名稱 / 說明 / 參數 schema 和原工具相同，LLM 看不出差別
+
+    ttl <= 0 或 TOOL_CACHE_ENABLED=false 時直接回傳原工具。
+    """
+    if ttl <= 0 or not settings.TOOL_CACHE_ENABLED:
+        return tool
+
+    func = getattr(tool, "func", None)
+    if func is None:
+        # 不是用 @tool 建立的 (沒有同步函式可以呼叫)，不包裝
+        return tool
+
+    with _caches_lock:
+        cache = _caches.setdefault(tool.name, ToolResultCache(ttl, maxsize or settings.TOOL_CACHE_MAX_ENTRIES))
+
+    signature = inspect.signature(func)
+    casefold_args = frozenset(casefold_args)
+    # admin / user 版的 search_litellm_logs 同名，用原函式區分
+    owner = f"{func.__module__}.{func.__qualname__}"
+
+    def run(**kwargs: Any) -> Any:
+        bound = signature.bind(**kwargs)
+        bound.apply_defaults()
+        args = dict(bound.arguments)
+        if cacheable_args is not None and not cacheable_args(args):
+            return func(**kwargs)
+
+        key = (owner,) + tuple(sorted((k, _normalize(v, k in casefold_args)) for k, v in args.items()))
+        result = cache.get(key)
+        if result is not None:
+            print(f"♻️ [Tool Cache] {tool.name} 命中快取")
+            return result
+
+        result = func(**kwargs)
+        if cacheable_result(result):
+            cache.put(key, result)
+        return result
+
+    return StructuredTool.from_function(
+        func=run,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        return_direct=tool.return_direct,
+    )
+
+
+def has_absolute_window(args: Dict[str, Any]) -> bool:
+    """
+    search_litellm_logs 只有指定了「已經結束」的絕對時間區間才快取
+    (lookback_minutes 是相對於現在的，每次查的範圍都不同；結束時間在未來的區間還會有新 log)。
+    時間和 SQL 一樣以 UTC+8 解讀。
+    """
+    start_time, end_time = args.get("start_time"), args.get("end_time")
+    if not start_time or not end_time:
+        return False
+    try:
+        end = datetime.datetime.fromisoformat(str(end_time).strip().replace("/", "-"))
+    except ValueError:
+        return False
+    if end.tzinfo is not None:
+        end = end.astimezone(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=8)
+    now_local = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=8)
+    return end < now_local
+
+
+def tool_cache_stats() -> Dict[str, dict]:
+    with _caches_lock:
+        return {name: cache.stats() for name, cache in _caches.items()}
@@ -0,0 +1,30 @@
+# app/tools/executor.py
+from typing import Any
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from app.utils.concurrency import run_in_tool_executor
+
+
+def offload_tool(tool: BaseTool) -> BaseTool:
+    """
+    讓同步工具在 async 路徑 (astream_events) 上改跑在專用的 tool thread pool，
+    而不是 event loop 的 default executor (見 app/utils/concurrency.py)。
+    名稱 / 說明 / 參數 schema 和原工具相同；同步呼叫 (invoke) 的行為不變。
+    """
+    func = getattr(tool, "func", None)
+    if func is None or getattr(tool, "coroutine", None) is not None:
+        # 沒有同步函式 (或本來就是 async 工具)，不需要包裝
+        return tool
+
+    async def arun(**kwargs: Any) -> Any:
+        return await run_in_tool_executor(func, **kwargs)
+
+    return StructuredTool.from_function(
+        func=func,
+        coroutine=arun,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        return_direct=tool.return_direct,
+    )
@@ -4,6 +4,7 @@ from typing import Optional
 from langchain.tools import tool
 from app.config import settings
 from app.rag.retriever import retrieve_cards
+from app.rag.prefetch import format_card_results, prefetched_cards_for
 
 @tool
 def search_error_cards(query: str):
@@ -15,17 +16,13 @@ def search_error_cards(query: str):
     
     輸入 query 應該是使用者遇到的錯誤訊息或問題關鍵字。
     """
-    # 這裡直接呼叫你原本的 retrieve_cards
-    hits = retrieve_cards(query, k=3)
-    
-    if not hits:
-        return "搜尋維運手冊後，沒有發現直接相關的說明。"
+    # 這一輪已經用使用者的輸入預先檢索過 (見 app/rag/prefetch.py)，查的是同一件事就直接用
+    hits = prefetched_cards_for(query, k=3)
+    if hits is None:
+        # 這裡直接呼叫你原本的 retrieve_cards
+        hits = retrieve_cards(query, k=3)
 
-    context_blocks = []
-    for idx, (card_id, content) in enumerate(hits, start=1):
-        context_blocks.append(f"[Result {idx}: {card_id}]\n{content}")
-    
-    return "\n\n".join(context_blocks)
+    return format_card_results(hits)
 
 # ==========================================
 # 核心邏輯 (修正版：從 metadata 挖出 user_api_key_alias)
@@ -147,8 +144,10 @@ def _core_log_search(
 
 # ==========================================
 # 工具定義 (雙軌制)
+# 兩個版本對 LLM 都叫 search_litellm_logs，由 llm_factory 依權限擇一放進工具箱，
+# 這樣 System Prompt 只要寫一套，也不需要在執行期去改共用工具物件的 name。
 # ==========================================
-@tool("search_litellm_logs_admin")
+@tool("search_litellm_logs")
 def search_litellm_logs_admin(
     key_name: Optional[str] = None,
     keyword: str = "",
@@ -165,7 +164,7 @@ def search_litellm_logs_admin(
     return _core_log_search(key_name, keyword, lookback_minutes, start_time, end_time)
 
 
-@tool("search_litellm_logs_user")
+@tool("search_litellm_logs")
 def search_litellm_logs_user(
     key_name: str,
     keyword: str = "",
@@ -0,0 +1,131 @@
+# app/utils/concurrency.py
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from app.config import settings
+
+T = TypeVar("T")
+
+
+class ServerBusyError(Exception):
+    """排隊的請求太多 (或等太久)，直接拒絕，避免請求無限堆積。"""
+
+
+class ConcurrencyLimiter:
+    """
+    對話請求的並發控制 (asyncio)：
+
+    - 全域最多 max_concurrent 個請求同時在跑 LLM / 工具
+    - 每個使用者最多 per_user 個 (避免一個人狂按把名額吃光)
+    - 超過的請求排隊等待；排隊中的請求超過 max_waiting、或等超過 wait_timeout 秒就回 ServerBusyError
+    """
+
+    def __init__(self, max_concurrent: int, per_user: int, max_waiting: int, wait_timeout: float) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_user = max(1, per_user)
+        self.max_waiting = max(0, max_waiting)
+        self.wait_timeout = wait_timeout
+        self._global: Optional[asyncio.Semaphore] = None
+        self._users: Dict[str, asyncio.Semaphore] = {}
+        # 使用者 -> 還沒離開 (排隊中 + 執行中) 的請求數，歸零時把 semaphore 清掉
+        self._user_refs: Dict[str, int] = {}
+        self.active = 0
+        self.waiting = 0
+
+    def _global_sem(self) -> asyncio.Semaphore:
+        # 延後到第一次使用才建立，確保綁定的是 Gradio 的 event loop
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_concurrent)
+        return self._global
+
+    def busy(self, user: str) -> bool:
+        """這個使用者現在進來是否需要排隊 (給 UI 顯示排隊訊息用)。"""
+        # 用計數判斷而不是 semaphore.locked()：同一輪 event loop 進來的請求還沒真的 acquire
+        return (
+            self.active + self.waiting >= self.max_concurrent
+            or self._user_refs.get(user, 0) >= self.per_user
+        )
+
+    def full(self) -> bool:
+        """排隊也排滿了，新的請求會直接被拒絕。"""
+        return self.active + self.waiting >= self.max_concurrent + self.max_waiting
+
+    def stats(self) -> dict:
+        return {"active": self.active, "waiting": self.waiting, "max_concurrent": self.max_concurrent}
+
+    @asynccontextmanager
+    async def slot(self, user: str):
+        if self.busy(user) and self.full():
+            raise ServerBusyError(f"排隊中的請求已達上限 ({self.max_waiting})")
+
+        user_sem = self._users.setdefault(user, asyncio.Semaphore(self.per_user))
+        self._user_refs[user] = self._user_refs.get(user, 0) + 1
+        global_sem = self._global_sem()
+        acquired_user = acquired_global = False
+
+        self.waiting += 1
+        try:
+            timeout = self.wait_timeout if self.wait_timeout > 0 else None
+            await asyncio.wait_for(user_sem.acquire(), timeout=timeout)
+            acquired_user = True
+            await asyncio.wait_for(global_sem.acquire(), timeout=timeout)
+            acquired_global = True
+        except asyncio.TimeoutError:
+            raise ServerBusyError(f"排隊超過 {self.wait_timeout:.0f} 秒")
+        finally:
+            self.waiting -= 1
+            if not acquired_global:
+                if acquired_user:
+                    user_sem.release()
+                self._release_user(user)
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            global_sem.release()
+            user_sem.release()
+            self._release_user(user)
+
+    def _release_user(self, user: str) -> None:
+        refs = self._user_refs.get(user, 1) - 1
+        if refs <= 0:
+            self._user_refs.pop(user, None)
+            self._users.pop(user, None)
+        else:
+            self._user_refs[user] = refs
+
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """
+    同步的 LangChain 工具 (psycopg2 / SMTP / Jira / GitHub) 與組 Agent 輸入 (讀檔 / 編碼圖片) 專用的 thread pool，
+    大小由 TOOL_THREAD_WORKERS 決定。event loop 的 default executor 不動 (其他套件也在用)。
+    """
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=max(1, settings.TOOL_THREAD_WORKERS), thread_name_prefix="wuli-tool",
+                )
+    return _tool_executor
+
+
+async def run_in_tool_executor(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在 get_tool_executor() 裡執行同步函式並等待結果；
+    會複製目前的 contextvars (例如 app/rag/prefetch.py 的預先檢索結果)，和 asyncio.to_thread 一樣。
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_tool_executor(), functools.partial(ctx.run, func, *args, **kwargs))
@@ -0,0 +1,285 @@
+# app/utils/documents.py
+import hashlib
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from app.config import settings
+
+DOCUMENT_EXTS = ('.pdf', '.docx')
+
+# 子程序每處理幾個檔案就換一個新的 (pypdf 解析怪檔案時記憶體不一定會還回來)
+MAX_TASKS_PER_WORKER = 50
+# 子程序自己會在 timeout 到時停下來回傳已抽出的部分；從它開始跑起算，多等這麼久才算真的卡住
+HARD_TIMEOUT_GRACE = 5.0
+# 等待結果時每隔幾秒檢查一次：工作開始了沒、跑了多久
+WAIT_POLL_INTERVAL = 0.5
+
+
+class DocumentText(NamedTuple):
+    text: str
+    pages: int                 # 實際讀了幾頁 (docx 為 0)
+    total_pages: int           # 文件總頁數 (docx 為 0)
+    truncated: Optional[str]   # 被截斷的原因 (None 代表完整)
+
+
+# ===================== 子程序端 =====================
+
+def _extract_pdf(path: str, max_pages: int, max_chars: int, deadline: float) -> DocumentText:
+    import pypdf
+
+    texts, chars, pages, truncated = [], 0, 0, None
+    # 傳檔案物件而不是路徑：pypdf 拿到路徑會把整個檔案讀進記憶體，檔案物件則是用到哪讀到哪
+    with open(path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        total = len(reader.pages)
+        for i in range(total):
+            if pages >= max_pages:
+                truncated = f"只讀取前 {max_pages} 頁"
+                break
+            if chars >= max_chars:
+                truncated = f"超過 {max_chars} 字"
+                break
+            if time.monotonic() > deadline:
+                truncated = "解析逾時"
+                break
+            extracted = reader.pages[i].extract_text()
+            pages += 1
+            if extracted:
+                texts.append(extracted[: max_chars - chars])
+                chars += len(texts[-1])
+
+    if truncated is None and chars >= max_chars and pages < total:
+        truncated = f"超過 {max_chars} 字"
+    return DocumentText("\n".join(texts), pages, total, truncated)
+
+
+def _extract_docx(path: str, max_chars: int, deadline: float) -> DocumentText:
+    import docx
+
+    texts, chars, truncated = [], 0, None
+    for para in docx.Document(path).paragraphs:
+        if chars >= max_chars:
+            truncated = f"超過 {max_chars} 字"
+            break
+        if time.monotonic() > deadline:
+            truncated = "解析逾時"
+            break
+        texts.append(para.text[: max_chars - chars])
+        chars += len(texts[-1]) + 1
+    return DocumentText("\n".join(texts), 0, 0, truncated)
+
+
+def _extract_worker(
+    path: str, ext: str, max_pages: int, max_chars: int, timeout: float, job_id: int, started: Any,
+) -> DocumentText:
+    # 記下實際開始的時間 (排隊等 worker 的時間不算)，主程序用它判斷這個工作是不是卡住了
+    started[job_id] = time.time()
+    deadline = time.monotonic() + timeout
+    if ext == ".pdf":
+        return _extract_pdf(path, max_pages, max_chars, deadline)
+    return _extract_docx(path, max_chars, deadline)
+
+
+# ===================== 主程序端 =====================
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """檔案內容的 sha256 (分段讀，不會整個載入記憶體)。"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DocumentExtractor:
+    """
+    PDF / DOCX 文字抽取：
+
+    - 在 process pool 裡解析 (pypdf 是純 Python，吃 CPU 又吃 GIL，放在 thread 裡會拖慢整個服務)
+    - 逐頁抽取，超過頁數 / 字數 / 時間上限就停，回傳已抽出的部分
+    - 以檔案內容 hash 快取結果 (同一份 runbook 重複上傳只解析一次)，並以總字數做 LRU 上限
+    - 同一份檔案同時被多個請求上傳時，只會送出一個解析工作
+    """
+
+    def __init__(self, workers: int, timeout: float, max_pages: int, max_chars: int, cache_max_chars: int) -> None:
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_pages = max(1, max_pages)
+        self.max_chars = max(1, max_chars)
+        self.cache_max_chars = cache_max_chars
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # job id -> 子程序開始解析的時間 (Manager dict，跨程序共用；pool 換掉也沿用)
+        self._manager = None
+        self._started: Any = None
+        self._job_ids = itertools.count()
+        self._cache: "OrderedDict[tuple, DocumentText]" = OrderedDict()
+        self._cache_chars = 0
+        # key -> (解析中的 future, 送出時的 pool, job id)
+        self._inflight: Dict[tuple, Tuple[Future, ProcessPoolExecutor, int]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn：主程序裡有一堆 thread (Gradio / scheduler / watcher)，fork 不安全
+            context = multiprocessing.get_context("spawn")
+            if self._manager is None:
+                self._manager = context.Manager()
+                self._started = self._manager.dict()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                max_tasks_per_child=MAX_TASKS_PER_WORKER,
+            )
+        return self._pool
+
+    def _recycle_pool(self, pool: ProcessPoolExecutor) -> None:
+        """有子程序卡死時，整個 pool 換掉 (卡住的程序直接砍掉；同時在跑的其他工作會重送一次)。"""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        processes = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+    def _key(self, path: str, ext: str) -> tuple:
+        return (file_digest(path), ext, self.max_pages, self.max_chars)
+
+    def submit(self, path: str) -> Optional[tuple]:
+        """開始解析 (不等結果)；已在快取或解析中就不重複送出。回傳之後 extract() 用的 key。"""
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in DOCUMENT_EXTS:
+            return None
+        key = self._key(path, ext)
+        with self._lock:
+            if key in self._cache or key in self._inflight:
+                return key
+            pool = self._get_pool()
+            job_id = next(self._job_ids)
+            future = pool.submit(
+                _extract_worker, path, ext, self.max_pages, self.max_chars, self.timeout, job_id, self._started,
+            )
+            self._inflight[key] = (future, pool, job_id)
+        future.add_done_callback(lambda _f, key=key, job_id=job_id: self._finish(key, job_id, _f))
+        return key
+
+    def _finish(self, key: tuple, job_id: int, future: Future) -> None:
+        try:
+            self._started.pop(job_id, None)
+        except Exception:
+            pass
+        with self._lock:
+            if self._inflight.get(key, (None,))[0] is future:
+                del self._inflight[key]
+            if future.cancelled() or future.exception() is not None:
+                return
+            result = future.result()
+            # 逾時的結果不快取 (下次可能就跑得完)
+            if result.truncated == "解析逾時" or key in self._cache:
+                return
+            self._cache[key] = result
+            self._cache_chars += len(result.text)
+            while self._cache_chars > self.cache_max_chars and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self._cache_chars -= len(old.text)
+
+    def extract(self, path: str, key: Optional[tuple] = None) -> DocumentText:
+        """解析並等待結果 (阻塞；async 路徑上請丟到 thread 執行)。超過時間上限會丟 TimeoutError。"""
+        key = key or self._key(path, os.path.splitext(path)[1].lower())
+        for attempt in range(2):
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return cached
+                inflight = self._inflight.get(key)
+            if inflight is None:
+                self.submit(path)
+                with self._lock:
+                    inflight = self._inflight.get(key)
+                    cached = self._cache.get(key)
+                if inflight is None:
+                    if cached is not None:
+                        return cached
+                    continue
+            future, pool, job_id = inflight
+
+            try:
+                result = self._wait(future, pool, job_id)
+            except (BrokenProcessPool, CancelledError):
+                # 別的檔案卡死導致 pool 被換掉 (跑到一半被砍掉 / 還在排隊被取消)：換新的 pool 再試一次
+                self._recycle_pool(pool)
+                continue
+            self.misses += 1
+            return result
+        raise RuntimeError("文件解析程序異常終止")
+
+    def _wait(self, future: Future, pool: ProcessPoolExecutor, job_id: int) -> DocumentText:
+        """
+        等待解析結果。還在排隊的工作不會逾時；
+        只有這個工作自己從開始跑起超過 timeout + HARD_TIMEOUT_GRACE 秒，才換掉 pool 並丟 TimeoutError。
+        """
+        while True:
+            try:
+                return future.result(timeout=WAIT_POLL_INTERVAL)
+            except FutureTimeoutError:
+                pass
+            try:
+                started = self._started.get(job_id)
+            except Exception:
+                started = None
+            if started is not None and time.time() - started > self.timeout + HARD_TIMEOUT_GRACE:
+                self.timeouts += 1
+                self._recycle_pool(pool)
+                raise TimeoutError(f"解析超過 {self.timeout:g} 秒")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._cache), "chars": self._cache_chars, "inflight": len(self._inflight),
+                "hits": self.hits, "misses": self.misses, "timeouts": self.timeouts,
+            }
+
+
+_extractor = DocumentExtractor(
+    workers=settings.DOC_EXTRACT_WORKERS,
+    timeout=settings.DOC_EXTRACT_TIMEOUT,
+    max_pages=settings.DOC_MAX_PAGES,
+    max_chars=settings.DOC_MAX_CHARS,
+    cache_max_chars=settings.DOC_CACHE_MAX_CHARS,
+)
+
+
+def submit_documents(paths) -> Dict[str, tuple]:
+    """同一則訊息上傳多份文件時，先全部送進 pool 平行解析；回傳 path -> key。"""
+    keys = {}
+    for path in paths or []:
+        try:
+            key = _extractor.submit(path)
+        except OSError:
+            continue
+        if key is not None:
+            keys[path] = key
+    return keys
+
+
+def extract_document(path: str, key: Optional[tuple] = None) -> DocumentText:
+    return _extractor.extract(path, key)
+
+
+def document_cache_stats() -> dict:
+    return _extractor.stats()
@@ -0,0 +1,251 @@
+# app/utils/history.py
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.config import settings
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
+
+# 一張圖片大約佔多少 token (各家計價方式不同，取常見的上限值估算)
+IMAGE_TOKENS = 1600
+
+# 摘要裡每則訊息最多保留幾個字
+SUMMARY_USER_CHARS = 160
+SUMMARY_ASSISTANT_CHARS = 240
+
+_CJK_RE = re.compile(r"[　-鿿가-힯＀-￯]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估 token 數 (不依賴 tokenizer)：中日韓文字約 1 字 1 token，其餘約 4 個字元 1 token。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_parts(content: Any) -> Tuple[List[str], List[str]]:
+    """
+    從 Gradio 訊息的 content 取出 (文字列表, 附件路徑列表)。
+    content 可能是字串、content block list、或單一個檔案 dict / tuple。
+    """
+    texts: List[str] = []
+    files: List[str] = []
+
+    def add_file(item: Any) -> None:
+        if isinstance(item, dict):
+            nested = item.get("file")
+            if isinstance(nested, dict):
+                item = nested
+            path = item.get("url") or item.get("path")
+        elif isinstance(item, (tuple, list)) and item:
+            path = item[0]
+        else:
+            path = None
+        if isinstance(path, str) and path:
+            files.append(path)
+
+    if isinstance(content, str):
+        texts.append(content)
+    elif isinstance(content, list):
+        for item in content:
+            if isinstance(item, str):
+                texts.append(item)
+            elif isinstance(item, dict) and item.get("type") == "text":
+                texts.append(item.get("text") or "")
+            elif isinstance(item, dict) and item.get("type") in ("file", "image"):
+                add_file(item)
+    elif isinstance(content, (dict, tuple)):
+        add_file(content)
+    return texts, files
+
+
+def message_tokens(msg: Dict[str, Any]) -> int:
+    texts, files = message_parts(msg.get("content"))
+    images = sum(1 for f in files if os.path.splitext(f)[1].lower() in IMAGE_EXTS)
+    return sum(estimate_tokens(t) for t in texts) + images * IMAGE_TOKENS
+
+
+def split_turns(history: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """一輪 = 使用者訊息 (可能多則，例如文字 + 附件) + 後面接著的助理訊息。"""
+    turns: List[List[Dict[str, Any]]] = []
+    for msg in history:
+        role = msg.get("role")
+        if role == "user" and (not turns or turns[-1][-1].get("role") != "user"):
+            turns.append([msg])
+        elif turns:
+            turns[-1].append(msg)
+        else:
+            turns.append([msg])
+    return turns
+
+
+def _clip(text: str, limit: int) -> str:
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def summarize_turn(turn: List[Dict[str, Any]]) -> str:
+    """把一輪對話壓成一兩行：文字截短、附件只留檔名。"""
+    user_texts, assistant_texts, attachments = [], [], []
+    for msg in turn:
+        texts, files = message_parts(msg.get("content"))
+        if msg.get("role") == "user":
+            user_texts.extend(texts)
+        else:
+            assistant_texts.extend(texts)
+        for f in files:
+            kind = "圖片" if os.path.splitext(f)[1].lower() in IMAGE_EXTS else "附件"
+            attachments.append(f"[{kind}: {os.path.basename(f)}]")
+
+    # 附件放前面，避免被截斷
+    user = _clip(" ".join(attachments) + " " + " ".join(t for t in user_texts if t), SUMMARY_USER_CHARS)
+    line = f"- 使用者: {user or '(無文字)'}"
+    assistant = _clip(" ".join(t for t in assistant_texts if t), SUMMARY_ASSISTANT_CHARS)
+    if assistant:
+        line += f"\n  Wuli: {assistant}"
+    return line
+
+
+def _update_hash(h: "hashlib._Hash", msg: Dict[str, Any]) -> None:
+    texts, files = message_parts(msg.get("content"))
+    h.update(str(msg.get("role")).encode("utf-8"))
+    for part in texts + files:
+        h.update(b"\x00" + part.encode("utf-8", errors="replace"))
+
+
+def _turn_hash(prev: str, turn: List[Dict[str, Any]]) -> str:
+    h = hashlib.sha1(prev.encode("utf-8"))
+    for msg in turn:
+        _update_hash(h, msg)
+    return h.hexdigest()
+
+
+def message_fingerprint(msg: Dict[str, Any]) -> str:
+    """單則訊息的指紋 (角色 + 文字 + 附件路徑)，用來確認前端送來的歷史和伺服器端記的是否一致。"""
+    h = hashlib.sha1()
+    _update_hash(h, msg)
+    return h.hexdigest()
+
+
+class RollingSummaryCache:
+    """
+    舊對話摘要的快取：key 是「前 i 輪」的累積 hash，value 是前 i 輪的摘要行。
+    同一段對話每多一輪，只需要摘要新被擠出去的那幾輪。
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def summary_lines(self, turns: List[List[Dict[str, Any]]]) -> List[str]:
+        hashes, prev = [], ""
+        for turn in turns:
+            prev = _turn_hash(prev, turn)
+            hashes.append(prev)
+
+        # 找最長的已快取前綴
+        lines: Tuple[str, ...] = ()
+        start = 0
+        with self._lock:
+            for i in range(len(hashes) - 1, -1, -1):
+                cached = self._data.get(hashes[i])
+                if cached is not None:
+                    self._data.move_to_end(hashes[i])
+                    lines, start = cached, i + 1
+                    break
+
+        for i in range(start, len(turns)):
+            lines = lines + (summarize_turn(turns[i]),)
+            with self._lock:
+                self._data[hashes[i]] = lines
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return list(lines)
+
+
+_summary_cache = RollingSummaryCache()
+
+
+class CompactedHistory(NamedTuple):
+    summary: Optional[str]                # 舊對話的摘要 (沒有需要摘要的內容時為 None)
+    messages: List[Dict[str, Any]]        # 原封不動保留的 Gradio 訊息
+    original_tokens: int
+    compacted_tokens: int
+    kept_turns: int = 0                   # messages 由最後幾輪組成
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.original_tokens - self.compacted_tokens)
+
+
+def compact_history(
+    history: List[Dict[str, Any]],
+    keep_turns: Optional[int] = None,
+    token_budget: Optional[int] = None,
+) -> CompactedHistory:
+    """
+    在 token 預算內壓縮對話歷史：
+    - 最近 keep_turns 輪原封不動保留 (超過預算時再往下減，至少保留最後一輪)
+    - 更早的對話換成 (有快取的) 逐輪摘要，附件只留檔名；摘要本身超過預算時從最舊的開始丟
+    """
+    turns = split_turns(history)
+    turn_tokens = [sum(message_tokens(m) for m in turn) for turn in turns]
+    return compact_turns(turns, turn_tokens, _summary_cache.summary_lines, keep_turns, token_budget)
+
+
+def compact_turns(
+    turns: List[List[Dict[str, Any]]],
+    turn_tokens: List[int],
+    summary_lines: Callable[[List[List[Dict[str, Any]]]], List[str]],
+    keep_turns: Optional[int] = None,
+    token_budget: Optional[int] = None,
+) -> CompactedHistory:
+    """
+    compact_history 的本體，輸入是已經切好的輪次和每輪的 token 數；
+    summary_lines(old_turns) 回傳較舊輪次的逐輪摘要 (由呼叫端決定怎麼快取)。
+    """
+    keep_turns = settings.HISTORY_KEEP_TURNS if keep_turns is None else keep_turns
+    token_budget = settings.HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+
+    original = sum(turn_tokens)
+
+    if token_budget <= 0 or (len(turns) <= keep_turns and original <= token_budget):
+        messages = [m for turn in turns for m in turn]
+        return CompactedHistory(None, messages, original, original, len(turns))
+
+    kept = min(len(turns), max(1, keep_turns))
+    while kept > 1 and sum(turn_tokens[-kept:]) > token_budget:
+        kept -= 1
+    kept_tokens = sum(turn_tokens[-kept:])
+
+    old_turns = turns[:-kept]
+    summary = None
+    summary_tokens = 0
+    if old_turns:
+        lines = summary_lines(old_turns)
+        remaining = max(0, token_budget - kept_tokens)
+        picked: List[str] = []
+        for line in reversed(lines):
+            cost = estimate_tokens(line)
+            if summary_tokens + cost > remaining:
+                break
+            picked.append(line)
+            summary_tokens += cost
+        if picked:
+            omitted = len(lines) - len(picked)
+            header = f"【先前對話摘要 (共 {len(lines)} 輪"
+            header += f"，最早的 {omitted} 輪已省略)】" if omitted else ")】"
+            summary = header + "\n" + "\n".join(reversed(picked))
+            summary_tokens = estimate_tokens(summary)
+
+    messages = [m for turn in turns[-kept:] for m in turn]
+    return CompactedHistory(summary, messages, original, kept_tokens + summary_tokens, kept)
@@ -0,0 +1,122 @@
+# app/utils/images.py
+import base64
+import io
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.config import settings
+
+# PIL 格式名稱 -> MIME
+_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+
+def _compress(path: str, max_side: int, fmt: str, quality: int) -> Tuple[str, bytes]:
+    """
+    讀圖 → 依 EXIF 轉正 → 長邊縮到 max_side → 重新壓縮。
+    壓完反而比原檔大 (例如已經很小的 PNG 截圖) 且不需要縮圖時，沿用原檔。
+    """
+    pil_format, mime = _FORMATS.get(fmt, _FORMATS["webp"])
+
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    with Image.open(io.BytesIO(raw)) as img:
+        img = ImageOps.exif_transpose(img)
+        resized = max(img.size) > max_side
+        if resized:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+
+        out = io.BytesIO()
+        if pil_format == "PNG":
+            img.save(out, format="PNG", optimize=True)
+        else:
+            img.save(out, format=pil_format, quality=quality)
+        data = out.getvalue()
+
+    if not resized and len(raw) <= len(data):
+        orig_mime, _ = mimetypes.guess_type(path)
+        return orig_mime or "image/jpeg", raw
+    return mime, data
+
+
+class ImageCache:
+    """
+    圖片 base64 快取：key 為 (路徑, 檔案大小, mtime)，value 為縮圖 + 重新壓縮後的 (mime, base64)。
+    同一張圖 (新上傳 / 歷史紀錄裡的) 只會讀檔、縮圖、編碼一次；以總 bytes 做 LRU 上限。
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[tuple, Tuple[str, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> Tuple[Optional[str], Optional[str]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, None
+        key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+        with self._lock:
+            cached = self._data.get(key)
+            if cached is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        mime, data = _compress(path, settings.IMAGE_MAX_SIDE, settings.IMAGE_FORMAT, settings.IMAGE_QUALITY)
+        encoded = base64.b64encode(data).decode("utf-8")
+
+        with self._lock:
+            self.misses += 1
+            if key not in self._data:
+                self._data[key] = (mime, encoded)
+                self._bytes += len(encoded)
+            while self._bytes > self.max_bytes and len(self._data) > 1:
+                _, (_, old) = self._data.popitem(last=False)
+                self._bytes -= len(old)
+        print(f"🖼️ 圖片壓縮 {os.path.basename(path)}: {st.st_size // 1024} KB → {len(data) // 1024} KB ({mime})")
+        return mime, encoded
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+_image_cache = ImageCache(max_bytes=settings.IMAGE_CACHE_MAX_BYTES)
+
+
+def encode_image_cached(image_path: str) -> Tuple[Optional[str], Optional[str]]:
+    """回傳 (mime_type, base64)；檔案不存在時回傳 (None, None)。"""
+    if not image_path or not os.path.exists(image_path):
+        return None, None
+    try:
+        return _image_cache.get(image_path)
+    except Exception as e:
+        # 無法解析 / 壓縮時退回原檔 (不快取)
+        print(f"⚠️ 圖片壓縮失敗，改送原檔 ({image_path}): {e}")
+        mime_type, _ = mimetypes.guess_type(image_path)
+        with open(image_path, "rb") as f:
+            return mime_type or "image/jpeg", base64.b64encode(f.read()).decode("utf-8")
+
+
+def image_cache_stats() -> dict:
+    return _image_cache.stats()
@@ -0,0 +1,247 @@
+# app/utils/log_triage.py
+import os
+import re
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.rag.query_cache import mask_volatile_tokens
+from app.rag.retriever import retrieve_cards_batch
+
+# 行首 / 行內的時間戳 (只用來記錄第一次 / 最後一次出現的時間，不做時區換算)
+_TIMESTAMP_RE = re.compile(
+    r"\d{4}[-/]\d{1,2}[-/]\d{1,2}[ T]\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"
+    r"|\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?\b"
+)
+
+# 明確標示為狀態碼的寫法 (HTTP 504 / HTTP/1.1 429 / status: 401 / "status_code": 500 / error code 403)，
+# 和 app/rag/query_parser.py 的判斷一致
+_STATUS_PREFIX = r"""\b(?:HTTP(?:/\d(?:\.\d)?)?|status(?:[ _]?code)?|(?:error[ _]?)?code)["']?\W{0,3}"""
+# 剩下的數字全部遮掉 (含 45s / 120ms 這種帶單位的)；只有狀態碼前後文裡的 4xx / 5xx 保留 (不同狀態碼是不同錯誤)
+_NUMBER_RE = re.compile(
+    rf"(?P<status>(?i:{_STATUS_PREFIX})[45]\d{{2}}\b)|(?<![A-Za-z0-9_.])\d+(?:\.\d+)?|<num>"
+)
+# 引號裡的長字串 (prompt 內容、檔名、user id...) 也遮掉
+_QUOTED_RE = re.compile(r"""(["'])[^"'\n]{24,}?\1""")
+# 不能吃掉換行：整個 chunk 一起做替換，之後才切行
+_WHITESPACE_RE = re.compile(r"[ \t]+")
+
+_ERROR_RE = re.compile(
+    r"\b(?:ERROR|FATAL|CRITICAL|CRIT|PANIC|Traceback|Exception|[A-Z][A-Za-z]+Error)\b"
+    rf"|(?i:{_STATUS_PREFIX})[45]\d{{2}}\b",
+)
+_WARN_RE = re.compile(r"\b(?:WARN|WARNING)\b")
+
+# 單行最多保留多少字 (避免一行好幾 MB 的 JSON 把記憶體吃掉)
+MAX_LINE_CHARS = 2000
+SAMPLE_CHARS = 300
+
+LEVEL_ERROR = 2
+LEVEL_WARN = 1
+LEVEL_OTHER = 0
+
+
+def _mask_number(m: "re.Match[str]") -> str:
+    return m.group("status") or "<n>"
+
+
+def line_template(text: str) -> str:
+    """
+    把 log 變成樣板：時間戳 / UUID / IP / request id / 數字 / 長字串都換成佔位符，
+    同一種訊息只會留下一種寫法。
+
+    所有替換都不會跨行，可以對整個 chunk 一次做完再切行 (比逐行呼叫快很多)。
+    """
+    text = mask_volatile_tokens(text)
+    text = _QUOTED_RE.sub(r"\1<str>\1", text)
+    text = _NUMBER_RE.sub(_mask_number, text)
+    return _WHITESPACE_RE.sub(" ", text)
+
+
+def line_level(line: str) -> int:
+    if _ERROR_RE.search(line):
+        return LEVEL_ERROR
+    if _WARN_RE.search(line):
+        return LEVEL_WARN
+    return LEVEL_OTHER
+
+
+class TemplateStats:
+    __slots__ = ("template", "count", "level", "first_ts", "last_ts", "first_line", "sample")
+
+    def __init__(self, template: str, level: int, line_no: int, sample: str) -> None:
+        self.template = template
+        self.count = 0
+        self.level = level
+        self.first_ts: Optional[str] = None
+        self.last_ts: Optional[str] = None
+        self.first_line = line_no
+        self.sample = sample
+
+
+class LogTriage:
+    """
+    串流式的 log 彙整：一次只處理一個 chunk，依樣板計數。
+
+    - 記憶體上限由 max_templates 決定 (與檔案大小無關)：
+      樣板數超過上限時，把出現次數最少的非錯誤樣板丟掉 (只保留被丟掉的行數)
+    - summary() 只輸出前 top_n 個錯誤樣板，prompt 大小和檔案大小無關
+    """
+
+    def __init__(self, max_templates: int = 5000) -> None:
+        self.max_templates = max(100, max_templates)
+        self.templates: Dict[str, TemplateStats] = {}
+        self.total_lines = 0
+        self.level_counts = [0, 0, 0]
+        self.dropped_lines = 0
+        self.first_ts: Optional[str] = None
+        self.last_ts: Optional[str] = None
+        self.bytes_read = 0
+
+    def feed_text(self, text: str) -> None:
+        """處理一段完整的行 (結尾不含半行)。"""
+        lines = text.split("\n")
+        templates = line_template(text).split("\n")
+        if len(templates) != len(lines):
+            # 理論上不會發生 (替換都不跨行)，保險起見退回逐行處理
+            templates = [line_template(line) for line in lines]
+
+        for line, template in zip(lines, templates):
+            template = template.strip()
+            if not template:
+                continue
+            self.total_lines += 1
+
+            ts_match = _TIMESTAMP_RE.search(line)
+            ts = ts_match.group(0) if ts_match else None
+            if ts:
+                self.first_ts = self.first_ts or ts
+                self.last_ts = ts
+
+            stats = self.templates.get(template)
+            if stats is None:
+                if len(self.templates) >= self.max_templates:
+                    self._evict()
+                # 等級判斷的關鍵字 (ERROR / HTTP 5xx ...) 不會被遮掉，同一個樣板的等級都一樣
+                stats = TemplateStats(template, line_level(line), self.total_lines, line[:SAMPLE_CHARS].rstrip("\r"))
+                self.templates[template] = stats
+
+            stats.count += 1
+            self.level_counts[stats.level] += 1
+            if ts:
+                stats.first_ts = stats.first_ts or ts
+                stats.last_ts = ts
+
+    def feed_file(self, path: str, chunk_size: int = 1024 * 1024) -> "LogTriage":
+        """以固定大小的 chunk 讀檔 (二進位 + 逐 chunk decode)，不會把整個檔案載入記憶體。"""
+        remainder = b""
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                data = remainder + chunk
+                cut = data.rfind(b"\n")
+                if cut < 0:
+                    # 一整個 chunk 都沒有換行：超長的單行只保留開頭
+                    remainder = data[:MAX_LINE_CHARS * 4]
+                    continue
+                remainder = data[cut + 1:]
+                self.feed_text(self._clip_lines(data[:cut].decode("utf-8", errors="replace")))
+        if remainder:
+            self.feed_text(self._clip_lines(remainder.decode("utf-8", errors="replace")))
+        return self
+
+    @staticmethod
+    def _clip_lines(text: str) -> str:
+        if len(text) <= MAX_LINE_CHARS or all(len(line) <= MAX_LINE_CHARS for line in text.split("\n")):
+            return text
+        return "\n".join(line[:MAX_LINE_CHARS] for line in text.split("\n"))
+
+    def _evict(self) -> None:
+        """樣板太多時，丟掉一半出現次數最少的樣板 (錯誤樣板最後才丟)。"""
+        ordered = sorted(self.templates.values(), key=lambda s: (s.level == LEVEL_ERROR, s.count))
+        for stats in ordered[: len(ordered) // 2]:
+            self.dropped_lines += stats.count
+            del self.templates[stats.template]
+
+    def top_templates(self, n: int, min_level: int = LEVEL_ERROR) -> List[TemplateStats]:
+        picked = [s for s in self.templates.values() if s.level >= min_level]
+        picked.sort(key=lambda s: (-s.level, -s.count, s.first_line))
+        return picked[:n]
+
+    def summary(self, filename: str, top_n: int = 20) -> str:
+        # 沒有錯誤樣板時，退而求其次列出警告樣板；都沒有就列出最常見的樣板
+        top, label = self.top_templates(top_n), "錯誤樣板"
+        if not top:
+            top, label = self.top_templates(top_n, min_level=LEVEL_WARN), "警告樣板"
+        if not top:
+            top, label = self.top_templates(top_n, min_level=LEVEL_OTHER), "樣板"
+
+        lines = [
+            f"檔案: {filename} ({self.bytes_read / 1024 / 1024:.1f} MB, {self.total_lines} 行)",
+            f"錯誤 {self.level_counts[LEVEL_ERROR]} 行 / 警告 {self.level_counts[LEVEL_WARN]} 行 / "
+            f"不同樣板 {len(self.templates)} 種",
+        ]
+        if self.first_ts:
+            lines.append(f"時間範圍: {self.first_ts} ~ {self.last_ts}")
+        if self.dropped_lines:
+            lines.append(f"(有 {self.dropped_lines} 行屬於低頻樣板，未列入統計)")
+
+        if top:
+            lines.append(f"\n出現最多的{label} (前 {len(top)} 種，<n>/<ts>/<id> 為遮蔽後的佔位符):")
+            for i, s in enumerate(top, 1):
+                when = f" | {s.first_ts} ~ {s.last_ts}" if s.first_ts else ""
+                lines.append(f"{i}. [x{s.count}{when}] {s.template[:SAMPLE_CHARS]}")
+                lines.append(f"   範例: {s.sample}")
+        return "\n".join(lines)
+
+
+def related_cards_summary(triage: LogTriage, top_n: int) -> str:
+    """
+    把前 top_n 個錯誤 (沒有的話警告) 樣板的範例行一次丟給 retrieve_cards_batch，
+    依「涵蓋幾行 log」排序列出可能相關的維運手冊卡片。
+    """
+    top = triage.top_templates(top_n) or triage.top_templates(top_n, min_level=LEVEL_WARN)
+    if not top:
+        return ""
+
+    batch = retrieve_cards_batch([s.sample for s in top], k=1)
+    covered: Dict[str, List[int]] = {}
+    for i, (stats, hits) in enumerate(zip(top, batch.hits), 1):
+        if hits:
+            covered.setdefault(hits[0].card_id, []).append(i)
+    print(
+        f"📚 [Log Triage] {len(top)} 個樣板對應卡片：去重後 {batch.unique_lines} 行，"
+        f"其中 {batch.embedded_lines} 行走向量檢索"
+    )
+    if not covered:
+        return ""
+
+    ranked = sorted(covered.items(), key=lambda kv: -sum(top[i - 1].count for i in kv[1]))
+    lines = ["可能相關的維運手冊卡片 (依涵蓋的 log 行數排序，可再用 search_error_cards 查詳細內容):"]
+    for card_id, idxs in ranked:
+        total = sum(top[i - 1].count for i in idxs)
+        lines.append(f"- {card_id}: {total} 行 (樣板 {', '.join(f'#{i}' for i in idxs)})")
+    return "\n".join(lines)
+
+
+def triage_log_file(path: str, filename: Optional[str] = None) -> str:
+    """
+    給上傳的 .log / .txt 用：串流彙整後回傳精簡摘要 (長度大約固定)。
+    LOG_TRIAGE_CARD_LOOKUP 開啟時，附上主要錯誤樣板對應的卡片。
+    """
+    triage = LogTriage(max_templates=settings.LOG_TRIAGE_MAX_TEMPLATES)
+    triage.feed_file(path, chunk_size=settings.LOG_TRIAGE_CHUNK_BYTES)
+    summary = triage.summary(filename or os.path.basename(path), top_n=settings.LOG_TRIAGE_TOP_N)
+
+    if settings.LOG_TRIAGE_CARD_LOOKUP:
+        try:
+            related = related_cards_summary(triage, settings.LOG_TRIAGE_TOP_N)
+        except Exception as e:
+            # 索引還沒建好 / embedding 失敗都不影響摘要本身
+            print(f"⚠️ Log 樣板對應卡片失敗: {e}")
+            related = ""
+        if related:
+            summary += "\n\n" + related
+    return summary
@@ -0,0 +1,57 @@
+# app/utils/metrics.py
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class LatencyRecorder:
+    """
+    各處理路徑 (agent / fast_llm / fast_template ...) 的延遲統計，
+    每個路徑只保留最近 window 筆 (總秒數, 第一個畫面的秒數)。
+    """
+
+    def __init__(self, window: int = 500) -> None:
+        self.window = window
+        self._samples: Dict[str, Deque[Tuple[float, Optional[float]]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, path: str, total: float, first_frame: Optional[float] = None) -> None:
+        with self._lock:
+            self._samples.setdefault(path, deque(maxlen=self.window)).append((total, first_frame))
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            snapshot = {path: list(samples) for path, samples in self._samples.items()}
+
+        out = {}
+        for path, samples in snapshot.items():
+            totals = [t for t, _ in samples]
+            firsts = [f for _, f in samples if f is not None]
+            out[path] = {
+                "count": len(samples),
+                "p50": round(_percentile(totals, 50), 3),
+                "p95": round(_percentile(totals, 95), 3),
+                "first_frame_p50": round(_percentile(firsts, 50), 3),
+            }
+        return out
+
+    def format_line(self, path: str) -> str:
+        stats = self.summary().get(path)
+        if not stats:
+            return f"[{path}] 尚無資料"
+        return (
+            f"[{path}] n={stats['count']} p50={stats['p50']:.2f}s p95={stats['p95']:.2f}s "
+            f"首個畫面 p50={stats['first_frame_p50']:.2f}s"
+        )
+
+
+# 對話回應的延遲 (respond 每一輪都會記錄)
+response_latency = LatencyRecorder()
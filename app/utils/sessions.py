@@ -0,0 +1,315 @@
+# app/utils/sessions.py
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.history import (
+    CompactedHistory,
+    compact_turns,
+    message_fingerprint,
+    message_parts,
+    message_tokens,
+    summarize_turn,
+)
+
+
+def _gradio_message_bytes(msg: Dict[str, Any]) -> int:
+    texts, files = message_parts(msg.get("content"))
+    return sum(len(t) for t in texts) + sum(len(f) for f in files)
+
+
+def _converted_bytes(messages: List[Any]) -> int:
+    """轉好的 LangChain 訊息大約佔多少記憶體 (以字串長度估算，base64 圖片佔大宗)。"""
+    total = 0
+    for msg in messages:
+        content = getattr(msg, "content", "")
+        if isinstance(content, str):
+            total += len(content)
+            continue
+        for block in content:
+            if isinstance(block, dict):
+                total += len(block.get("text") or "") + len((block.get("image_url") or {}).get("url") or "")
+    return total
+
+
+class SessionHistory:
+    """
+    伺服器端記住的一段對話：Gradio 每次都會把完整 history 送回來，
+    這裡記下已經處理過的前綴，之後每輪只處理新增的訊息 (delta)。
+
+    每輪的 token 數、摘要行、轉好的 LangChain 訊息都存起來，
+    組 Agent 輸入時只需要取最後幾輪，成本和對話長度無關。
+    """
+
+    def __init__(self) -> None:
+        self.turns: List[List[Dict[str, Any]]] = []
+        self.turn_tokens: List[int] = []
+        self.turn_summaries: List[str] = []
+        # 已經吸收的 Gradio 訊息數，以及最後一則的指紋
+        self.seen = 0
+        self.last_fingerprint: Optional[str] = None
+        self.updated_at = time.time()
+        # (輪次 index, 是否保留圖片) -> (轉好的 LangChain 訊息, 估算大小)；含 base64，不寫進 SQLite
+        self._converted: Dict[Tuple[int, bool], Tuple[List[Any], int]] = {}
+        # 原始 Gradio 訊息 / 轉好的訊息大約佔多少 bytes (SessionStore 用來控制總記憶體)
+        self.raw_bytes = 0
+        self.converted_bytes = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop("lock", None)
+        state["_converted"] = {}
+        state["converted_bytes"] = 0
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def reset(self) -> None:
+        self.turns, self.turn_tokens, self.turn_summaries = [], [], []
+        self.seen = 0
+        self.last_fingerprint = None
+        self.raw_bytes = 0
+        self.drop_converted()
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.raw_bytes + self.converted_bytes
+
+    def _pop_converted(self, key: Tuple[int, bool]) -> None:
+        entry = self._converted.pop(key, None)
+        if entry is not None:
+            self.converted_bytes -= entry[1]
+
+    def drop_converted(self) -> int:
+        """丟掉所有轉好的訊息 (下次用到再重新轉換)；回傳釋放的估算大小。"""
+        freed = self.converted_bytes
+        self._converted = {}
+        self.converted_bytes = 0
+        return freed
+
+    def sync(self, history: List[Dict[str, Any]]) -> int:
+        """
+        吸收前端送來的 history，回傳這次新處理的訊息數。
+        前綴對不上 (重新產生 / 編輯 / 清除對話) 時整段重建。
+        """
+        self.updated_at = time.time()
+        if self.seen > len(history) or (
+            self.seen and message_fingerprint(history[self.seen - 1]) != self.last_fingerprint
+        ):
+            self.reset()
+
+        touched = set()
+        for msg in history[self.seen:]:
+            if msg.get("role") == "user" and (not self.turns or self.turns[-1][-1].get("role") != "user"):
+                self.turns.append([msg])
+                self.turn_tokens.append(0)
+                self.turn_summaries.append("")
+            elif self.turns:
+                self.turns[-1].append(msg)
+            else:
+                self.turns.append([msg])
+                self.turn_tokens.append(0)
+                self.turn_summaries.append("")
+            touched.add(len(self.turns) - 1)
+            self.raw_bytes += _gradio_message_bytes(msg)
+
+        for i in touched:
+            self.turn_tokens[i] = sum(message_tokens(m) for m in self.turns[i])
+            self.turn_summaries[i] = summarize_turn(self.turns[i])
+            self._pop_converted((i, True))
+            self._pop_converted((i, False))
+
+        added = len(history) - self.seen
+        self.seen = len(history)
+        self.last_fingerprint = message_fingerprint(history[-1]) if history else None
+        return added
+
+    def compact(self, keep_turns: Optional[int] = None, token_budget: Optional[int] = None) -> CompactedHistory:
+        return compact_turns(
+            self.turns,
+            self.turn_tokens,
+            lambda old_turns: self.turn_summaries[: len(old_turns)],
+            keep_turns,
+            token_budget,
+        )
+
+    def converted_turn(self, index: int, keep_images: bool, convert: Callable[[List[Dict[str, Any]], bool], List[Any]]) -> List[Any]:
+        key = (index, keep_images)
+        entry = self._converted.get(key)
+        if entry is None:
+            messages = convert(self.turns[index], keep_images)
+            entry = (messages, _converted_bytes(messages))
+            self._converted[key] = entry
+            self.converted_bytes += entry[1]
+            # 圖片保留與否只會從 True 變成 False (輪次變舊)，舊的那份用不到了
+            self._pop_converted((index, not keep_images))
+        return entry[0]
+
+    def drop_converted_before(self, index: int) -> None:
+        """已經不在保留範圍內的輪次 (只剩摘要)，轉好的訊息就不用留著了。"""
+        for key in [k for k in self._converted if k[0] < index]:
+            self._pop_converted(key)
+
+
+class SessionStore:
+    """
+    session id -> SessionHistory。
+
+    - 記憶體中最多 max_sessions 段對話 (LRU)；超過時最久沒用的寫進 SQLite (有設定 sqlite_path 時)，否則直接丟掉
+    - 所有對話估算的總大小超過 max_bytes 時，先從最久沒用的對話丟掉轉好的訊息 (含 base64 圖片)，
+      還是超過才整段移出記憶體 (同上，寫進 SQLite 或丟掉)
+    - 超過 ttl 秒沒有新訊息的對話會被清掉 (記憶體與 SQLite 都是)
+    - 被丟掉的對話下次進來時，從前端送來的完整 history 重建一次即可，不影響正確性
+    """
+
+    def __init__(self, max_sessions: int, ttl: float, sqlite_path: Optional[str] = None, max_bytes: int = 0) -> None:
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, SessionHistory]" = OrderedDict()
+        # session id -> 上次結算時的估算大小
+        self._sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.spilled = 0
+        if sqlite_path:
+            os.makedirs(os.path.dirname(os.path.abspath(sqlite_path)), exist_ok=True)
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, updated_at REAL, data BLOB)"
+            )
+            self._db.commit()
+
+    @contextmanager
+    def session(self, session_id: str):
+        """取得 (並鎖住) 一段對話；同一個 session 同時有兩個請求時依序處理。"""
+        state = self._get(session_id)
+        try:
+            with state.lock:
+                yield state
+        finally:
+            # 這一輪可能新增了訊息 / 轉換快取，重新結算大小
+            with self._lock:
+                if self._sessions.get(session_id) is state:
+                    self._set_size(session_id, state.memory_bytes)
+                self._enforce_bytes(keep=session_id)
+
+    def _set_size(self, session_id: str, size: int) -> None:
+        self.total_bytes += size - self._sizes.get(session_id, 0)
+        self._sizes[session_id] = size
+
+    def _remove(self, session_id: str) -> SessionHistory:
+        self.total_bytes -= self._sizes.pop(session_id, 0)
+        return self._sessions.pop(session_id)
+
+    def _enforce_bytes(self, keep: str) -> None:
+        """總大小超過 max_bytes：先丟最舊對話的轉換快取，不夠再整段移出 (正在使用中的對話跳過)。"""
+        if self.max_bytes <= 0 or self.total_bytes <= self.max_bytes:
+            return
+        for session_id, state in list(self._sessions.items()):
+            if self.total_bytes <= self.max_bytes:
+                return
+            if session_id == keep or not state.converted_bytes or not state.lock.acquire(blocking=False):
+                continue
+            try:
+                state.drop_converted()
+                self._set_size(session_id, state.memory_bytes)
+            finally:
+                state.lock.release()
+        for session_id, state in list(self._sessions.items()):
+            if self.total_bytes <= self.max_bytes:
+                return
+            if session_id == keep or state.lock.locked():
+                continue
+            self._spill(session_id, self._remove(session_id))
+
+    def _get(self, session_id: str) -> SessionHistory:
+        with self._lock:
+            self._purge_expired()
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+                self.hits += 1
+                return state
+
+            state = self._load(session_id)
+            if state is None:
+                self.misses += 1
+                state = SessionHistory()
+            else:
+                self.hits += 1
+            self._sessions[session_id] = state
+            self._set_size(session_id, state.memory_bytes)
+            while len(self._sessions) > self.max_sessions:
+                old_id = next(iter(self._sessions))
+                self._spill(old_id, self._remove(old_id))
+            return state
+
+    def _purge_expired(self) -> None:
+        if self.ttl <= 0:
+            return
+        cutoff = time.time() - self.ttl
+        # OrderedDict 依最近使用排序，從最舊的開始檢查
+        while self._sessions:
+            session_id, state = next(iter(self._sessions.items()))
+            if state.updated_at >= cutoff:
+                break
+            self._remove(session_id)
+
+    def _spill(self, session_id: str, state: SessionHistory) -> None:
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, updated_at, data) VALUES (?, ?, ?)",
+                (session_id, state.updated_at, pickle.dumps(state)),
+            )
+            if self.ttl > 0:
+                self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+            self._db.commit()
+            self.spilled += 1
+        except Exception as e:
+            print(f"⚠️ 對話狀態寫入 SQLite 失敗 ({session_id}): {e}")
+
+    def _load(self, session_id: str) -> Optional[SessionHistory]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT updated_at, data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.commit()
+            if self.ttl > 0 and row[0] < time.time() - self.ttl:
+                return None
+            return pickle.loads(row[1])
+        except Exception as e:
+            print(f"⚠️ 從 SQLite 讀取對話狀態失敗 ({session_id}): {e}")
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions), "bytes": self.total_bytes,
+                "hits": self.hits, "misses": self.misses, "spilled": self.spilled,
+            }
+
+
+session_store = SessionStore(
+    max_sessions=settings.SESSION_MAX_IN_MEMORY,
+    ttl=settings.SESSION_TTL,
+    sqlite_path=settings.SESSION_SQLITE_PATH or None,
+    max_bytes=settings.SESSION_MAX_BYTES,
+)
@@ -0,0 +1,49 @@
+# app/utils/streaming.py
+import time
+from typing import Any, Optional
+
+
+def content_to_text(content: Any) -> str:
+    """
+    LLM 輸出 / token chunk 可能是字串，也可能是 content block list
+    (Bedrock / Anthropic 會回 [{"type": "text", "text": ...}, {"type": "tool_use", ...}])，
+    這裡只取出文字部分。
+    """
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        text_parts = []
+        for block in content:
+            if isinstance(block, dict) and "text" in block:
+                text_parts.append(block["text"])
+            elif isinstance(block, str):
+                text_parts.append(block)
+        return "".join(text_parts)
+    return str(content)
+
+
+class FrameCoalescer:
+    """
+    把 token 合併成有時間間隔的畫面更新：最多每 interval 秒送一次完整文字，
+    不會每個 token 都把整段字串重送給瀏覽器。
+    串流結束後呼叫端一定會再送一次完整的最終回答，最後幾個 token 不需要另外補送。
+    """
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = max(0.0, interval)
+        self.text = ""
+        self._last_emit = 0.0
+
+    def reset(self) -> None:
+        self.text = ""
+
+    def push(self, delta: str) -> Optional[str]:
+        """加入新的文字；到了該更新畫面的時間就回傳目前的完整文字，否則回傳 None。"""
+        self.text += delta
+        now = time.monotonic()
+        if now - self._last_emit >= self.interval:
+            self._last_emit = now
+            return self.text
+        return None
@@ -0,0 +1,113 @@
+# scripts/bench_vector_backends.py
+"""
+比較 Chroma 與 NumPy 向量後端的查詢延遲。
+
+以 error_docs/ 的卡片為種子，複製成 N 張合成卡片 (隨機單位向量，不呼叫任何 embedding API)，
+分別建立 Chroma collection (和正式環境相同的設定：HNSW + L2) 與 NumPy 精確 cosine 索引，量測單筆查詢延遲。
+(向量都是單位向量，L2 與 cosine 的排序相同。)
+
+    python -m scripts.bench_vector_backends
+    python -m scripts.bench_vector_backends --sizes 10,1000 --dim 256 --queries 100
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+
+from app.rag.chroma_store import COLLECTION_METADATA
+from app.rag.error_card_loader import load_error_cards
+from app.rag.numpy_store import NumpyVectorIndex, normalize_rows
+from app.rag.retriever import ERROR_DOCS_DIR
+
+# Chroma 單次 add 的上限
+CHROMA_BATCH = 5000
+
+
+def synthetic_corpus(n: int, dim: int, rng: np.random.Generator):
+    seeds = load_error_cards(ERROR_DOCS_DIR) or []
+    ids, docs, metas = [], [], []
+    for i in range(n):
+        seed = seeds[i % len(seeds)] if seeds else None
+        ids.append(f"{seed.id if seed else 'CARD'}-{i:06d}")
+        docs.append(seed.content if seed else f"synthetic card {i}")
+        metas.append({"component": seed.component if seed else "generic"})
+    vectors = normalize_rows(rng.standard_normal((n, dim), dtype=np.float32))
+    return ids, docs, metas, vectors
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(name, n, build_s, latencies):
+    ms = [x * 1000 for x in latencies]
+    print(
+        f"{name:<7} n={n:<7} build={build_s:8.2f}s  "
+        f"mean={statistics.mean(ms):7.3f}ms  p50={percentile(ms, 0.5):7.3f}ms  p95={percentile(ms, 0.95):7.3f}ms"
+    )
+
+
+def bench_chroma(ids, docs, metas, vectors, queries, k, workdir):
+    client = chromadb.PersistentClient(path=workdir)
+    collection = client.create_collection("bench", metadata=COLLECTION_METADATA)
+
+    started = time.perf_counter()
+    for start in range(0, len(ids), CHROMA_BATCH):
+        end = start + CHROMA_BATCH
+        collection.add(
+            ids=ids[start:end],
+            documents=docs[start:end],
+            metadatas=metas[start:end],
+            embeddings=vectors[start:end].tolist(),
+        )
+    build_s = time.perf_counter() - started
+
+    latencies = []
+    for q in queries:
+        t = time.perf_counter()
+        collection.query(query_embeddings=[q.tolist()], n_results=k)
+        latencies.append(time.perf_counter() - t)
+    return build_s, latencies
+
+
+def bench_numpy(ids, metas, vectors, queries, k, workdir):
+    started = time.perf_counter()
+    NumpyVectorIndex(vectors, ids, metas).save(workdir)
+    index = NumpyVectorIndex.load(workdir)
+    build_s = time.perf_counter() - started
+
+    latencies = []
+    for q in queries:
+        t = time.perf_counter()
+        index.search(q, k=k)
+        latencies.append(time.perf_counter() - t)
+    return build_s, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma vs NumPy vector backend benchmark")
+    parser.add_argument("--sizes", default="10,1000,100000", help="逗號分隔的卡片數量")
+    parser.add_argument("--dim", type=int, default=1536, help="向量維度 (text-embedding-3-small 為 1536)")
+    parser.add_argument("--queries", type=int, default=200, help="每個大小量測幾筆查詢")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        ids, docs, metas, vectors = synthetic_corpus(n, args.dim, rng)
+        queries = normalize_rows(rng.standard_normal((args.queries, args.dim), dtype=np.float32))
+
+        with tempfile.TemporaryDirectory() as chroma_dir, tempfile.TemporaryDirectory() as numpy_dir:
+            build_s, lat = bench_chroma(ids, docs, metas, vectors, queries, args.k, chroma_dir)
+            summarize("chroma", n, build_s, lat)
+            build_s, lat = bench_numpy(ids, metas, vectors, queries, args.k, numpy_dir)
+            summarize("numpy", n, build_s, lat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# scripts/export_index.py
+import argparse
+
+from app.config import settings
+from app.rag.retriever import export_rag_artifact
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the error card index as a portable artifact")
+    parser.add_argument(
+        "--output",
+        default=settings.INDEX_ARTIFACT_PATH or "./dist/error_cards_index.zip",
+        help="輸出檔案路徑 (預設為 INDEX_ARTIFACT_PATH)",
+    )
+    args = parser.parse_args()
+
+    summary = export_rag_artifact(args.output)
+    print(
+        f"Exported {summary['count']} cards (dim={summary['dim']}, model={summary['model_id']}) "
+        f"to '{summary['path']}'"
+    )
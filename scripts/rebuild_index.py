@@ -1,6 +1,23 @@
 # scripts/rebuild_index.py
-from app.rag.retriever import init_rag
+import argparse
+
+from app.rag.retriever import init_rag, rollback_rag_index
 
 if __name__ == "__main__":
-    cards, collection = init_rag()
-    print(f"Reindexed {len(cards)} error cards into collection '{collection.name}'")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Rebuild (or roll back) the error card index")
+    parser.add_argument("--rollback", action="store_true", help="切回上一個索引版本，不重新 embedding")
+    args = parser.parse_args()
+
+    if args.rollback:
+        version = rollback_rag_index()
+        if version:
+            print(f"Rolled back error card index to '{version}'")
+        else:
+            print("No previous index version to roll back to")
+    else:
+        cards, collection, stats = init_rag()
+        print(f"Reindexed {len(cards)} error cards into collection '{collection.name}'")
+        print(
+            f"  added: {stats['added']} | updated: {stats['updated']} | "
+            f"removed: {stats['removed']} | unchanged: {stats['unchanged']}"
+        )
@@ -0,0 +1,52 @@
+# tests/test_embedding_function.py
+"""
+LangChainOpenAIEmbeddingFunction 的冒煙測試：不打 provider (用假的 Embeddings 取代)，
+確認 embedding 快取有接上、第二次呼叫不會再送 provider。
+
+    python -m pytest -q tests
+"""
+from app.config import settings
+from app.rag import chroma_store
+
+
+class FakeEmbeddings:
+    def __init__(self) -> None:
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def make_fn(monkeypatch, tmp_path):
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_PATH", str(tmp_path / "emb.sqlite3"))
+    fn = chroma_store.LangChainOpenAIEmbeddingFunction()
+    fn._emb = FakeEmbeddings()
+    return fn
+
+
+def embed(fn, texts):
+    # Chroma 會把 EmbeddingFunction 的回傳值轉成 numpy array
+    return [[float(x) for x in vec] for vec in fn(texts)]
+
+
+def test_embedding_function_uses_cache(monkeypatch, tmp_path):
+    fn = make_fn(monkeypatch, tmp_path)
+
+    assert embed(fn, ["hello"]) == [[5.0, 1.0]]
+    assert embed(fn, ["hello", "hello", "wuli"]) == [[5.0, 1.0], [5.0, 1.0], [4.0, 1.0]]
+    # 第二次只有沒看過的 "wuli" 會送 provider
+    assert fn._emb.calls == [["hello"], ["wuli"]]
+
+    stats = fn.cache_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2
+
+
+def test_seed_cache(monkeypatch, tmp_path):
+    fn = make_fn(monkeypatch, tmp_path)
+
+    assert fn.seed_cache(["seeded"], [[0.5, 0.5]]) == 1
+    assert embed(fn, ["seeded"]) == [[0.5, 0.5]]
+    assert fn._emb.calls == []